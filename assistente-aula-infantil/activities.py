@@ -3,6 +3,8 @@ from dataclasses import dataclass
 from typing import Dict, Any
 import random
 
+import question_bank
+
 @dataclass
 class Activity:
     enunciado: str
@@ -10,6 +12,8 @@ class Activity:
     materia: str  # "matematica" | "portugues"
 
 def math_activity(level: int) -> Activity:
+    # faixas próprias desta atividade (1..9, 10..99), mais largas que as do banco
+    # de questões: por isso não saem de question_bank
     if level <= 3:
         a, b = random.randint(1, 9), random.randint(1, 9)
         return Activity(enunciado=f"Calcule: {a} + {b} = ?", gabarito=a+b, materia="matematica")
@@ -21,30 +25,9 @@ def math_activity(level: int) -> Activity:
         return Activity(enunciado=f"Calcule: {a} + {b} = ?", gabarito=a+b, materia="matematica")
 
 def portugues_activity(level: int) -> Activity:
-    if level <= 3:
-        pares = [
-            ("Complete com *c* ou *ç*: _a__a", "c"),  # casa
-            ("Escreva o plural: *flor* → ?", "flores"),
-            ("Escolha a forma correta: *mas* ou *mais* para oposição?", "mas"),
-        ]
-        enunciado, gab = random.choice(pares)
-        return Activity(enunciado=enunciado, gabarito=gab, materia="portugues")
-    elif level <= 6:
-        pares = [
-            ("Complete: *porque, por que, porquê ou por quê?* — 'Não fui ___ estava doente.'", "porque"),
-            ("Acentue corretamente: *voce, cafe, ideia*", "você, café, ideia"),
-            ("Classifique: 'O gato dorme.' — sujeito simples ou composto?", "simples"),
-        ]
-        enunciado, gab = random.choice(pares)
-        return Activity(enunciado=enunciado, gabarito=gab, materia="portugues")
-    else:
-        pares = [
-            ("Sinônimo de *tranquilo* (um):", "calmo"),
-            ("Identifique o verbo na frase: 'Eles *brincaram* no parque.'", "brincaram"),
-            ("Pontue: 'quando cheguei ela sorriu'", "Quando cheguei, ela sorriu."),
-        ]
-        enunciado, gab = random.choice(pares)
-        return Activity(enunciado=enunciado, gabarito=gab, materia="portugues")
+    tier = 1 if level <= 3 else 2 if level <= 6 else 3
+    i = question_bank.draw("pt_open", tier)
+    return Activity(enunciado=question_bank.PROMPT[i], gabarito=question_bank.ANSWER[i], materia="portugues")
 
 def build_daily_activity(user: Dict[str, Any]) -> Dict[str, Activity]:
     lvl_mat = user["levels"]["matematica"]
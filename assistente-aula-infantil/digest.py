@@ -0,0 +1,123 @@
+# Envio do resumo semanal em lote: as mensagens vêm de um gerador (ordenado
+# por destinatário), saem num ritmo controlado por token bucket com poucos
+# envios simultâneos, e o progresso fica salvo por janela no storage. Um
+# restart retoma do último destinatário confirmado em vez de reenviar tudo.
+
+import os, socket, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# (cursor, destinatário, texto, remetente); o cursor cresce ao longo do gerador
+Message = Tuple[str, str, str, str]
+
+class TokenBucket:
+    """`rate` envios/s em média, com rajada de até `burst`. acquire() bloqueia."""
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = max(rate, 1e-6)
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(self.burst)
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            self.sleep(wait)
+
+    def reserve(self) -> float:
+        """Sem bloquear: reserva o próximo envio e devolve em quantos segundos
+        ele pode sair (0 = já). Reservas seguidas ficam em fila, 1/rate de distância."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1.0
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+class DigestDispatcher:
+    """Uma rodada por `run_id` (a semana), em janelas de `window` mensagens.
+
+    - `send(to, body, from_)`: entrega (ou enfileira) uma mensagem
+    - `load_checkpoint()` / `save_checkpoint(cp)`: {"run", "cursor", "sent", "failed", "done"}
+    - `acquire_lease(owner, ttl_s)`: renovado a cada janela; perdeu = para
+
+    O checkpoint só avança quando a janela inteira terminou, então um crash
+    no meio reenvia no máx. essa janela (`window` mensagens). `rate_per_s <= 0`
+    desliga o ritmo aqui, para quando quem entrega de fato (o outbox) já limita.
+    """
+
+    def __init__(self, send: Callable[[str, str, str], Any],
+                 load_checkpoint: Callable[[], Optional[Dict[str, Any]]],
+                 save_checkpoint: Callable[[Dict[str, Any]], None],
+                 acquire_lease: Callable[[str, float], bool],
+                 rate_per_s: float = 5.0, burst: int = 10, concurrency: int = 4, window: int = 20,
+                 lease_ttl_s: float = 300.0, bucket: Optional[TokenBucket] = None):
+        self.send = send
+        self.load_checkpoint = load_checkpoint
+        self.save_checkpoint = save_checkpoint
+        self.acquire_lease = acquire_lease
+        self.bucket = bucket or (TokenBucket(rate_per_s, burst) if rate_per_s > 0 else None)
+        self.concurrency = max(1, concurrency)
+        self.window = max(1, window)
+        self.lease_ttl_s = lease_ttl_s
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._thread: Optional[threading.Thread] = None
+        self._guard = threading.Lock()
+
+    def _send_one(self, msg: Message) -> bool:
+        if self.bucket is not None: self.bucket.acquire()
+        try:
+            self.send(msg[1], msg[2], msg[3])
+            return True
+        except Exception:
+            return False
+
+    def run(self, run_id: str, messages: Iterable[Message]) -> Dict[str, Any]:
+        if not self.acquire_lease(self.owner, self.lease_ttl_s): return self.load_checkpoint() or {}
+        cp = self.load_checkpoint() or {}  # lido já com o lease: outro processo pode ter avançado
+        if cp.get("run") != run_id: cp = {"run": run_id, "cursor": "", "sent": 0, "failed": 0, "done": False}
+        if cp["done"]: return cp
+        it = (m for m in messages if m[0] > cp["cursor"])
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="digest-send") as ex:
+            while True:
+                batch = _take(it, self.window)
+                if not batch: break
+                oks = list(ex.map(self._send_one, batch))
+                cp["sent"] += sum(oks)
+                cp["failed"] += len(oks) - sum(oks)
+                cp["cursor"] = batch[-1][0]
+                self.save_checkpoint(cp)
+                if not self.acquire_lease(self.owner, self.lease_ttl_s): return cp
+        cp["done"] = True
+        self.save_checkpoint(cp)
+        return cp
+
+    def start(self, run_id: str, messages: Callable[[], Iterable[Message]]) -> bool:
+        """Roda em segundo plano; False se já há uma rodada neste processo."""
+        with self._guard:
+            if self._thread is not None and self._thread.is_alive(): return False
+            self._thread = threading.Thread(target=lambda: self.run(run_id, messages()),
+                                            name="digest-dispatcher", daemon=True)
+            self._thread.start()
+            return True
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+def _take(it: Iterator[Message], n: int) -> List[Message]:
+    out: List[Message] = []
+    for m in it:
+        out.append(m)
+        if len(out) >= n: break
+    return out
@@ -0,0 +1,50 @@
+# Idempotência do webhook: o Twilio reenvia a mesma mensagem (mesmo
+# MessageSid) quando a resposta demora. Guardamos a TwiML já respondida por
+# SID, com limite de itens e validade, e o reenvio recebe a cópia sem tocar
+# no registro do usuário.
+
+import threading, time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+class ReplyCache:
+    """LRU por ordem de inserção com TTL; O(1) para get/put e despejo."""
+
+    def __init__(self, max_items: int = 10000, ttl_s: float = 600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_items = max(1, max_items)
+        self.ttl_s = ttl_s
+        self.clock = clock
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # sid -> (expira_em, twiml)
+
+    def _evict(self, now: float) -> None:
+        # a ordem de inserção é a ordem de expiração (TTL fixo)
+        while self._items:
+            sid, (exp, _) = next(iter(self._items.items()))
+            if exp > now and len(self._items) <= self.max_items: break
+            self._items.popitem(last=False)
+
+    def get(self, sid: str) -> Optional[str]:
+        if not sid: return None
+        with self._lock:
+            hit = self._items.get(sid)
+            if hit is None: return None
+            if hit[0] <= self.clock():
+                del self._items[sid]
+                return None
+            self.hits += 1
+            return hit[1]
+
+    def put(self, sid: str, twiml: str) -> None:
+        if not sid: return
+        with self._lock:
+            now = self.clock()
+            self._items.pop(sid, None)
+            self._items[sid] = (now + self.ttl_s, twiml)
+            self._evict(now)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
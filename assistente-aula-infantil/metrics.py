@@ -0,0 +1,100 @@
+# Métricas em memória do processo (contadores, gauges e histogramas), expostas
+# em /admin/metrics no formato texto do Prometheus. Com METRICS_ENABLED=False
+# as chamadas voltam na primeira linha e `timer` devolve um contexto nulo.
+
+import contextlib, os, threading, time
+from bisect import bisect_left
+from typing import Any, Dict, Iterator, List, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True") == "True"
+
+# segundos; cobre de leitura em cache (<1 ms) a gravação de JSON grande (segundos)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+_NULL = contextlib.nullcontext()
+
+class Registry:
+    def __init__(self, enabled: bool = True, buckets: Tuple[float, ...] = BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[_Key, float] = {}
+        self._gauges: Dict[_Key, float] = {}
+        self._hists: Dict[_Key, List[float]] = {}  # [contagem por bucket..., +Inf, soma]
+
+    def inc(self, name: str, n: float = 1, **labels: str) -> None:
+        if not self.enabled: return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        if not self.enabled: return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        if not self.enabled: return
+        key = (name, tuple(sorted(labels.items())))
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None: h = self._hists[key] = [0.0] * (len(self.buckets) + 2)
+            h[i] += 1
+            h[-1] += seconds
+
+    def timer(self, name: str, **labels: str) -> Any:
+        if not self.enabled: return _NULL
+        return self._timer(name, labels)
+
+    @contextlib.contextmanager
+    def _timer(self, name: str, labels: Dict[str, str]) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear(); self._gauges.clear(); self._hists.clear()
+
+    # ---------- exposição ----------
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            hists = {k: list(v) for k, v in self._hists.items()}
+        out: List[str] = []
+        for kind, series in (("counter", counters), ("gauge", gauges)):
+            for name in sorted({n for n, _ in series}):
+                self._header(out, name, kind)
+                for (n, labels), v in sorted(series.items()):
+                    if n == name: out.append(f"{name}{_fmt_labels(labels)} {_num(v)}")
+        for name in sorted({n for n, _ in hists}):
+            self._header(out, name, "histogram")
+            for (n, labels), h in sorted(hists.items()):
+                if n != name: continue
+                acc = 0.0
+                for le, c in zip(self.buckets + (float("inf"),), h[:-1]):
+                    acc += c
+                    le_s = "+Inf" if le == float("inf") else repr(le)
+                    out.append(f"{name}_bucket{_fmt_labels(labels + (('le', le_s),))} {_num(acc)}")
+                out.append(f"{name}_sum{_fmt_labels(labels)} {h[-1]:.6f}")
+                out.append(f"{name}_count{_fmt_labels(labels)} {_num(acc)}")
+        return "\n".join(out) + "\n"
+
+    def _header(self, out: List[str], name: str, kind: str) -> None:
+        out.append(f"# TYPE {name} {kind}")
+
+def _fmt_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels: return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+# registro padrão do processo
+registry = Registry(METRICS_ENABLED)
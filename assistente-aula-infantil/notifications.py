@@ -1,2 +1,105 @@
+# Agendador interno dos check-ins: dorme até o próximo prazo (lembrete + 3h)
+# do índice de agenda e só então processa os usuários vencidos. Com vários
+# processos waitress, só quem detém o lease no storage executa a rodada.
 
-# Futuro: integrar agendamentos (APScheduler/cron/Railway cron) para disparar 'iniciar' nos horários definidos.
+import os, socket, threading, uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+class CheckinScheduler:
+    """Thread única que acorda exatamente no próximo prazo conhecido.
+
+    - `now`: relógio no fuso do projeto
+    - `next_deadline(now)`: próximo instante com prazo vencendo (ou None)
+    - `run_due(now)`: processa quem venceu; devolve quantos usuários tratou
+    - `acquire_lease(owner, ttl_s)`: True se este processo pode rodar agora
+
+    O lease vale `max_sleep_s + tick_budget_s` e quem o detém renova antes de
+    cada espera, então ele não caduca enquanto o dono está vivo (uma rodada
+    não deve passar de `tick_budget_s`).
+    """
+
+    def __init__(self, now: Callable[[], datetime],
+                 next_deadline: Callable[[datetime], Optional[datetime]],
+                 run_due: Callable[[datetime], int],
+                 acquire_lease: Callable[[str, float], bool],
+                 max_sleep_s: float = 300.0, tick_budget_s: float = 120.0):
+        self.now = now
+        self.next_deadline = next_deadline
+        self.run_due = run_due
+        self.acquire_lease = acquire_lease
+        self.max_sleep_s = max_sleep_s
+        self.lease_ttl_s = max_sleep_s + tick_budget_s
+        self._leader = False
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.last_run: Optional[str] = None
+        self.last_count = 0
+        self._wake = threading.Event()
+        self._poked = False
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "CheckinScheduler":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="checkin-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        self._stop = True
+        self._wake.set()
+        if self._thread: self._thread.join(timeout)
+        self._thread = None
+        if self._leader:  # devolve o lease para outro processo assumir já
+            try: self.acquire_lease(self.owner, 0.0)
+            except Exception: pass
+            self._leader = False
+
+    def poke(self) -> None:
+        """Agenda mudou (wizard salvou): recalcula o próximo despertar. Só roda
+        a rodada se, com a agenda nova, algum prazo já venceu."""
+        self._poked = True
+        self._wake.set()
+
+    def tick(self) -> int:
+        now = self.now()
+        self._leader = self.acquire_lease(self.owner, self.lease_ttl_s)
+        if not self._leader: return 0
+        self.last_count = self.run_due(now)
+        self.last_run = now.isoformat()
+        return self.last_count
+
+    def seconds_until_next(self) -> float:
+        now = self.now()
+        nxt = self.next_deadline(now)
+        if nxt is None:  # nada hoje: acorda na virada do dia
+            nxt = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return max(0.0, min((nxt - now).total_seconds(), self.max_sleep_s))
+
+    def _renew(self) -> None:
+        if not self._leader: return
+        try:
+            self._leader = self.acquire_lease(self.owner, self.lease_ttl_s)
+        except Exception:
+            pass  # storage indisponível: o lease ainda cobre a espera em curso
+
+    def _loop(self) -> None:
+        due = True
+        while not self._stop:
+            try:
+                if due: self.tick()
+                wait = self.seconds_until_next()
+            except Exception:
+                wait = min(60.0, self.max_sleep_s)  # storage indisponível: tenta de novo depois
+            due = True
+            self._renew()
+            while not self._stop and self._wake.wait(wait):
+                self._wake.clear()
+                if not self._poked: break  # stop()
+                self._poked = False
+                try:
+                    wait = self.seconds_until_next()
+                except Exception:
+                    break
+                if wait <= 0: break
+                self._renew()
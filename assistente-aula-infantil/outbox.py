@@ -0,0 +1,229 @@
+# Fila de saída (WhatsApp proativo): o webhook enfileira e responde na hora;
+# workers entregam com retry/backoff. Pendentes ficam em disco e são
+# reentregues após restart: cada mudança é uma linha acrescentada a
+# <path>.log, e de tempos em tempos o estado vira um snapshot em <path>.
+
+import heapq, json, os, threading, time, uuid
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from storage import atomic_write_json
+
+class PermanentSendError(Exception):
+    """Erro que não adianta repetir (ex.: número inválido): vai direto para `dead`."""
+
+class FakeTwilioClient:
+    """Cliente Twilio em memória para rodar tudo offline (TWILIO_FAKE=True).
+
+    `fail_first` faz as primeiras N chamadas falharem, para exercitar o retry.
+    """
+
+    def __init__(self, fail_first: int = 0):
+        self.sent: List[Dict[str, str]] = []
+        self.fail_first = fail_first
+        self._lock = threading.Lock()
+        self.messages = self
+
+    def create(self, from_: str = "", to: str = "", body: str = "", **kw: Any) -> Any:
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                raise ConnectionError("fake twilio: falha simulada")
+            sid = f"SMfake{len(self.sent):08d}"
+            self.sent.append({"sid": sid, "from": from_, "to": to, "body": body})
+        return type("FakeMessage", (), {"sid": sid})()
+
+class Outbox:
+    DEAD_KEEP = 100
+    COMPACT_MIN = 1000  # linhas no log antes de pensar em compactar
+
+    def __init__(self, path: str, send: Callable[[str, str, str], Any], workers: int = 2,
+                 max_attempts: int = 5, base_delay: float = 2.0,
+                 rate_limits: Optional[Dict[str, Any]] = None):
+        """`rate_limits`: {lane: limitador com reserve(), ex. digest.TokenBucket};
+        itens enfileirados com essa `lane` saem no ritmo dele, sem prender worker."""
+        self.path = path
+        self.rate_limits = dict(rate_limits or {})
+        self._reserved: Set[str] = set()  # já com vaga reservada no limitador
+        self.send = send
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self._cv = threading.Condition()
+        self._heap: List[Tuple[float, str]] = []   # (next_at, id)
+        self._items: Dict[str, Dict[str, Any]] = {}  # pendentes (inclui em voo)
+        self._dead: List[Dict[str, Any]] = []
+        self._inflight = 0
+        self._threads: List[threading.Thread] = []
+        self._stop = False
+        self.log_path = path + ".log"
+        self._seq = 0           # última linha do log aplicada
+        self._log_lines = 0
+        self._load()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._log = open(self.log_path, "a", encoding="utf-8")
+
+    # ---------- persistência ----------
+    # Snapshot {"seq", "pending", "dead"} + log JSONL com {"seq", "op", ...}:
+    # add (item novo), ack (entregue), retry (nova tentativa) e dead. Na
+    # partida, snapshot + as linhas do log com seq maior refazem a fila.
+    def _load(self) -> None:
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._seq = int(data.get("seq", 0))
+            self._dead = list(data.get("dead") or [])
+            for it in data.get("pending") or []: self._items[it["id"]] = it
+        if os.path.exists(self.log_path):
+            good = 0
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"): raise ValueError
+                        rec = json.loads(line)
+                    except ValueError:
+                        break  # última linha cortada por um crash
+                    good += len(line)
+                    self._log_lines += 1
+                    if int(rec.get("seq", 0)) <= self._seq: continue
+                    self._seq = int(rec["seq"])
+                    self._replay(rec)
+            # descarta o resto cortado para as próximas linhas não grudarem nele
+            if good < os.path.getsize(self.log_path): os.truncate(self.log_path, good)
+        self._dead = self._dead[-self.DEAD_KEEP:]
+        for it in self._items.values():
+            heapq.heappush(self._heap, (float(it.get("next_at", 0)), it["id"]))
+
+    def _replay(self, rec: Dict[str, Any]) -> None:
+        op = rec.get("op")
+        if op == "add":
+            self._items[rec["it"]["id"]] = rec["it"]
+        elif op == "ack":
+            self._items.pop(rec["id"], None)
+        elif op == "retry":
+            it = self._items.get(rec["id"])
+            if it is not None: it.update(attempts=rec["attempts"], next_at=rec["next_at"], last_error=rec["last_error"])
+        elif op == "dead":
+            self._items.pop(rec["it"]["id"], None)
+            self._dead.append(rec["it"])
+
+    def _append(self, rec: Dict[str, Any]) -> None:
+        # chamado com self._cv travado: uma linha, custo independente do tamanho da fila
+        self._seq += 1
+        rec["seq"] = self._seq
+        self._log.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._log.flush()
+        self._log_lines += 1
+        if self._log_lines >= max(self.COMPACT_MIN, 4 * (len(self._items) + len(self._dead))): self._compact()
+
+    def _compact(self) -> None:
+        # amortizado: só depois de o log crescer várias vezes o tamanho da fila.
+        # Crash entre o snapshot e o truncate é inofensivo (o seq filtra o replay).
+        self._dead = self._dead[-self.DEAD_KEEP:]
+        atomic_write_json(self.path, {"seq": self._seq, "pending": list(self._items.values()), "dead": self._dead})
+        self._log.close()
+        self._log = open(self.log_path, "w", encoding="utf-8")
+        self._log_lines = 0
+
+    # ---------- API ----------
+    def enqueue(self, to: str, body: str, from_: str = "", lane: str = "") -> str:
+        """`from_`: remetente (número do tenant); vazio = o padrão do envio.
+        `lane`: chave em rate_limits ("" = sem limite)."""
+        it = {"id": uuid.uuid4().hex, "to": to, "body": body, "from": from_, "attempts": 0,
+              "next_at": time.time(), "created": time.time()}
+        if lane: it["lane"] = lane
+        with self._cv:
+            self._items[it["id"]] = it
+            heapq.heappush(self._heap, (it["next_at"], it["id"]))
+            self._append({"op": "add", "it": it})
+            self._cv.notify()
+        return it["id"]
+
+    def start(self) -> "Outbox":
+        with self._cv:
+            if self._threads: return self
+            self._stop = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        with self._cv:
+            self._stop = True
+            self._cv.notify_all()
+        for t in self._threads: t.join(timeout)
+        self._threads = []
+        with self._cv: self._compact()
+
+    def drain(self, timeout: float = 10.0) -> bool:
+        """Espera esvaziar a fila (True) ou estourar o timeout (False)."""
+        end = time.time() + timeout
+        with self._cv:
+            while self._items:
+                left = end - time.time()
+                if left <= 0: return False
+                self._cv.wait(min(left, 0.05))
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._cv:
+            return {"pending": len(self._items), "inflight": self._inflight, "dead": len(self._dead)}
+
+    # ---------- worker ----------
+    def _next(self) -> Optional[Dict[str, Any]]:
+        with self._cv:
+            while not self._stop:
+                if self._heap:
+                    at, iid = self._heap[0]
+                    wait = at - time.time()
+                    if wait <= 0:
+                        heapq.heappop(self._heap)
+                        it = self._items.get(iid)
+                        if it is None: continue
+                        limit = self.rate_limits.get(it.get("lane") or "")
+                        if limit is not None and iid not in self._reserved:
+                            delay = limit.reserve()
+                            if delay > 0:  # volta para a fila na hora da vaga
+                                self._reserved.add(iid)
+                                heapq.heappush(self._heap, (time.time() + delay, iid))
+                                continue
+                        self._reserved.discard(iid)
+                        self._inflight += 1
+                        return it
+                    self._cv.wait(wait)
+                else:
+                    self._cv.wait()
+            return None
+
+    def _worker(self) -> None:
+        while True:
+            it = self._next()
+            if it is None: return
+            err: Optional[Exception] = None
+            permanent = False
+            try:
+                self.send(it["to"], it["body"], it.get("from") or "")
+            except PermanentSendError as e:
+                err, permanent = e, True
+            except Exception as e:
+                err = e
+            with self._cv:
+                self._inflight -= 1
+                if err is None:
+                    self._items.pop(it["id"], None)
+                    self._append({"op": "ack", "id": it["id"]})
+                else:
+                    it["attempts"] = int(it.get("attempts", 0)) + 1
+                    it["last_error"] = f"{type(err).__name__}: {err}"
+                    if permanent or it["attempts"] >= self.max_attempts:
+                        self._items.pop(it["id"], None)
+                        self._dead.append(it)
+                        del self._dead[:-self.DEAD_KEEP]
+                        self._append({"op": "dead", "it": it})
+                    else:
+                        it["next_at"] = time.time() + self.base_delay * (2 ** (it["attempts"] - 1))
+                        heapq.heappush(self._heap, (it["next_at"], it["id"]))
+                        self._append({"op": "retry", "id": it["id"], "attempts": it["attempts"],
+                                      "next_at": it["next_at"], "last_error": it["last_error"]})
+                self._cv.notify_all()
@@ -0,0 +1,165 @@
+# Banco de questões: todos os itens de Matemática (op, a, b) e de Português são
+# enumerados uma única vez, na importação, em tabelas paralelas indexadas pelo
+# id do item. Sorteios por (op, nível) saem de buckets prontos, e o "já visto"
+# de cada criança é um bitset compacto sobre esses ids.
+
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+MATH_OPS = ("+", "-", "*", "/")
+LEVELS = (1, 2, 3)
+
+# Faixas de operandos por nível. Nível 1 = as faixas originais da aula (2..9).
+def _math_pairs(op: str, level: int) -> List[Tuple[int, int]]:
+    r = lambda lo, hi: range(lo, hi + 1)
+    if op == "+":
+        if level == 1: return [(a, b) for a in r(2, 9) for b in r(2, 9)]
+        if level == 2: return [(a, b) for a in r(10, 19) for b in r(2, 9)]
+        return [(a, b) for a in r(10, 19) for b in r(10, 19)]
+    if op == "-":
+        if level == 1: return [(a, b) for a in r(2, 9) for b in r(2, 9) if a >= b]
+        if level == 2: return [(a, b) for a in r(10, 19) for b in r(2, 9)]
+        return [(a, b) for a in r(20, 29) for b in r(10, 19)]
+    if op == "*":
+        if level == 1: return [(a, b) for a in r(2, 9) for b in r(2, 9)]
+        if level == 2: return [(a, b) for a in r(2, 12) for b in r(10, 12)]
+        return [(a, b) for a in r(10, 19) for b in r(2, 9)]
+    # "/": a = b * q, sempre exata
+    if level == 1: return [(b * q, b) for b in r(2, 9) for q in r(2, 9)]
+    if level == 2: return [(b * q, b) for b in r(2, 9) for q in r(10, 12)]
+    return [(b * q, b) for b in r(10, 12) for q in r(2, 12)]
+
+def _math_pool(op: str, correct: int) -> Tuple[int, ...]:
+    """Candidatos a distratores (mesmas regras de antes da aula)."""
+    if op in ("+", "-"):
+        return tuple(x for x in range(max(0, correct - 4), correct + 5) if x != correct)
+    if op == "*":
+        return tuple(correct + d for d in (-6, -4, -3, -2, -1, 1, 2, 3, 4, 6) if correct + d > 0)
+    return tuple(dict.fromkeys(v for v in (max(1, correct + d) for d in (-3, -2, -1, 1, 2, 3)) if v != correct))
+
+_SYMBOL = {"+": "+", "-": "-", "*": "×", "/": "÷"}
+
+# Português, múltipla escolha: (nível, enunciado, opções, índice correto)
+PT_CHOICE = [
+    (1, "Qual está escrito corretamente?", ("Exceção", "Excessão", "Eceção", "Ecessão"), 0),
+    (1, "Qual plural está correto para *pão*?", ("pãos", "pães", "pãoses", "pãeses"), 1),
+    (1, "Qual forma está correta?", ("A gente vamos", "A gente vai", "Nós vai", "Nós vamos ir"), 1),
+    (1, "Complete: Ela ___ ao mercado ontem.", ("vai", "foi", "iria", "vou"), 1),
+    (1, "Qual está escrito corretamente?", ("cachorro", "caxorro", "cachoro", "caxoro"), 0),
+    (1, "Qual é o plural de *animal*?", ("animals", "animais", "animales", "animaus"), 1),
+    (1, "Complete: Nós ___ para a escola cedo.", ("vai", "vamos", "vou", "vão"), 1),
+    (1, "Qual está escrito corretamente?", ("Caza", "Casa", "Kasa", "Cassa"), 1),
+    (1, "Qual é o feminino de *menino*?", ("menina", "meninoa", "menine", "menininho"), 0),
+    (1, "Qual é o contrário de *alto*?", ("grande", "baixo", "largo", "fino"), 1),
+    (1, "Complete: Eu ___ um livro toda noite.", ("lê", "leio", "lemos", "leem"), 1),
+    (1, "Qual é o diminutivo de *pé*?", ("pezinho", "pézão", "pesinho", "pezão"), 0),
+    (1, "Qual frase é uma pergunta?", ("Você vem amanhã.", "Você vem amanhã?", "Você vem amanhã!", "Você vem, amanhã."), 1),
+    (1, "Quantas sílabas tem *borboleta*?", ("2", "3", "4", "5"), 2),
+]
+# Uma aula tira PT_ROUNDS_PER_DAY itens do nível 1: com menos itens que isso, toda
+# aula repetiria e zeraria o bucket, e o "já visto" não serviria para nada.
+
+# Português, resposta aberta (activities.portugues_activity): (nível, enunciado, gabarito)
+PT_OPEN = [
+    (1, "Complete com *c* ou *ç*: _a__a", "c"),  # casa
+    (1, "Escreva o plural: *flor* → ?", "flores"),
+    (1, "Escolha a forma correta: *mas* ou *mais* para oposição?", "mas"),
+    (2, "Complete: *porque, por que, porquê ou por quê?* — 'Não fui ___ estava doente.'", "porque"),
+    (2, "Acentue corretamente: *voce, cafe, ideia*", "você, café, ideia"),
+    (2, "Classifique: 'O gato dorme.' — sujeito simples ou composto?", "simples"),
+    (3, "Sinônimo de *tranquilo* (um):", "calmo"),
+    (3, "Identifique o verbo na frase: 'Eles *brincaram* no parque.'", "brincaram"),
+    (3, "Pontue: 'quando cheguei ela sorriu'", "Quando cheguei, ela sorriu."),
+]
+
+# ---------- tabelas (id = posição) ----------
+KIND: List[str] = []     # "math" | "pt" | "pt_open"
+OP: List[str] = []       # op de matemática, ou "pt"/"pt_open"
+LEVEL: List[int] = []
+A: List[int] = []
+B: List[int] = []
+ANSWER: List[Any] = []   # valor correto (math), índice correto (pt) ou gabarito (pt_open)
+POOL: List[Tuple[Any, ...]] = []  # distratores (math) ou opções (pt)
+PROMPT: List[str] = []
+BUCKETS: Dict[Tuple[str, int], List[int]] = {}
+
+def _add(kind: str, op: str, level: int, a: int, b: int, answer: Any, pool: Tuple[Any, ...], prompt: str) -> None:
+    BUCKETS.setdefault((op, level), []).append(len(KIND))
+    KIND.append(kind); OP.append(op); LEVEL.append(level)
+    A.append(a); B.append(b); ANSWER.append(answer); POOL.append(pool); PROMPT.append(prompt)
+
+def _build() -> None:
+    for op in MATH_OPS:
+        for level in LEVELS:
+            for a, b in _math_pairs(op, level):
+                correct = {"+": a + b, "-": a - b, "*": a * b, "/": a // b if b else 0}[op]
+                _add("math", op, level, a, b, correct, _math_pool(op, correct), f"Quanto é {a} {_SYMBOL[op]} {b}?")
+    for level, prompt, options, ans in PT_CHOICE:
+        _add("pt", "pt", level, 0, 0, ans, options, prompt)
+    for level, prompt, gab in PT_OPEN:
+        _add("pt_open", "pt_open", level, 0, 0, gab, (), prompt)
+
+_build()
+SIZE = len(KIND)
+
+# ---------- bitset de itens já vistos ----------
+def seen_from_hex(s: Optional[str]) -> bytearray:
+    bits = bytearray.fromhex(s or "")
+    need = (SIZE + 7) // 8
+    return bits + bytearray(need - len(bits)) if len(bits) < need else bits
+
+def seen_to_hex(bits: bytearray) -> str:
+    return bytes(bits).hex()
+
+def _is_seen(bits: bytearray, i: int) -> bool:
+    return bool(bits[i >> 3] >> (i & 7) & 1)
+
+def _set_seen(bits: bytearray, i: int) -> None:
+    bits[i >> 3] |= 1 << (i & 7)
+
+# ---------- sorteio ----------
+def bucket(op: str, level: int) -> List[int]:
+    """Itens de (op, nível); sem itens naquele nível, cai para o mais próximo abaixo."""
+    for lv in range(max(LEVELS[0], min(level, LEVELS[-1])), 0, -1):
+        ids = BUCKETS.get((op, lv))
+        if ids: return ids
+    return BUCKETS[(op, 1)]
+
+def draw(op: str, level: int, rng: Any = random, seen: Optional[bytearray] = None) -> int:
+    """Sorteia um id de (op, nível) evitando os já vistos; esgotado o bucket,
+    zera só os bits dele e recomeça. O(1) esperado (tentativas aleatórias)."""
+    ids = bucket(op, level)
+    if seen is None: return rng.choice(ids)
+    for _ in range(8):
+        i = rng.choice(ids)
+        if not _is_seen(seen, i):
+            _set_seen(seen, i)
+            return i
+    fresh = [i for i in ids if not _is_seen(seen, i)]
+    if not fresh:
+        for i in ids: seen[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+        fresh = ids
+    i = rng.choice(fresh)
+    _set_seen(seen, i)
+    return i
+
+def question(item: int, rng: Any = random) -> Dict[str, Any]:
+    """Pergunta de múltipla escolha (a..d) do item; `rng` decide distratores/ordem."""
+    if KIND[item] == "pt":
+        return {"type": "pt", "item": item, "prompt": PROMPT[item],
+                "options": list(POOL[item]), "answer": ANSWER[item]}
+    correct = ANSWER[item]
+    pool = list(POOL[item])
+    rng.shuffle(pool)
+    options = [correct] + pool[:3]
+    rng.shuffle(options)
+    return {
+        "type": "math",
+        "item": item,
+        "op": OP[item],
+        "a": A[item],
+        "b": B[item],
+        "prompt": PROMPT[item],
+        "options": [str(x) for x in options],
+        "answer": options.index(correct),  # 0..3
+    }
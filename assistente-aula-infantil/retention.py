@@ -0,0 +1,43 @@
+# Retenção do daily_state: os últimos dias ficam inline; os mais antigos viram
+# agregados mensais compactos em user["daily_summary"] e, opcionalmente, vão
+# crus para um arquivo JSONL só de acréscimo.
+
+import json, os
+from datetime import date, timedelta
+from typing import Any, Dict, List, Tuple
+
+def _month_entry(summary: Dict[str, Any], day_key: str) -> Dict[str, int]:
+    return summary.setdefault(day_key[:7], {"days": 0, "done": 0, "miss": 0, "mask": 0})
+
+def compact_daily_state(user: Dict[str, Any], today: str, keep_days: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """Move para o resumo mensal os dias anteriores a `today - keep_days`.
+
+    Resumo por "YYYY-MM": dias registrados, dias feitos, avisos de falta e
+    `mask` com o bit (dia-1) ligado para cada dia feito. Devolve os dias removidos.
+    """
+    ds: Dict[str, Any] = user.get("daily_state") or {}
+    cutoff = (date.fromisoformat(today) - timedelta(days=max(0, keep_days))).isoformat()
+    old = sorted(k for k in ds if k < cutoff)
+    if not old: return []
+    summary = user.setdefault("daily_summary", {})
+    removed: List[Tuple[str, Dict[str, Any]]] = []
+    for day_key in old:
+        st = ds.pop(day_key) or {}
+        m = _month_entry(summary, day_key)
+        m["days"] += 1
+        if st.get("done"):
+            m["done"] += 1
+            m["mask"] |= 1 << (int(day_key[8:10]) - 1)
+        if st.get("miss_notified"): m["miss"] += 1
+        removed.append((day_key, st))
+    return removed
+
+def archive_days(path: str, user_key: str, days: List[Tuple[str, Dict[str, Any]]]) -> None:
+    if not path or not days: return
+    d = os.path.dirname(path)
+    if d: os.makedirs(d, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for day_key, st in days:
+            f.write(json.dumps({"user": user_key, "day": day_key, **st}, ensure_ascii=False, separators=(",", ":")) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
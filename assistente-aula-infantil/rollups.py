@@ -0,0 +1,117 @@
+# Agregados de progresso por usuário em user["rollup"], atualizados em O(1)
+# a cada resposta, aula concluída e dia feito. O relatório e o resumo semanal
+# leem só daqui (nunca o daily_state cru nem as aulas, que são descartadas).
+#
+# {"ops": {op: {"q": perguntas, "hits": acertos, "tries": respostas}},
+#  "weeks": {"2026-W42": dias feitos}, "months": {"2026-10": dias feitos},
+#  "lessons": n, "streak": n, "best": n, "last_done": "YYYY-MM-DD"}
+
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+KEEP_WEEKS = 12
+KEEP_MONTHS = 12
+OP_NAMES = {"+": "soma", "-": "subtração", "*": "multiplicação", "/": "divisão", "pt": "português"}
+_OP_ORDER = {op: i for i, op in enumerate(OP_NAMES)}
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+def _roll(user: Dict[str, Any]) -> Dict[str, Any]:
+    r = user.get("rollup")
+    if r is None:
+        r = user["rollup"] = {"ops": {}, "weeks": {}, "months": {}, "lessons": 0, "streak": 0, "best": 0, "last_done": None}
+    return r
+
+def week_key(day: date) -> str:
+    y, w, _ = day.isocalendar()
+    return f"{y}-W{w:02d}"
+
+def _bump(counts: Dict[str, int], key: str, keep: int) -> None:
+    counts[key] = int(counts.get(key, 0)) + 1
+    while len(counts) > keep:
+        del counts[min(counts)]
+
+def record_answer(user: Dict[str, Any], op: str, correct: bool, resolved: bool) -> None:
+    """Uma resposta na pergunta de `op`; `resolved` = a pergunta terminou aqui
+    (acerto ou última tentativa)."""
+    e = _roll(user)["ops"].setdefault(op, {"q": 0, "hits": 0, "tries": 0})
+    e["tries"] += 1
+    if resolved: e["q"] += 1
+    if correct: e["hits"] += 1
+
+def record_lesson(user: Dict[str, Any]) -> None:
+    _roll(user)["lessons"] += 1
+
+def _scheduled(schedule: Dict[str, Any]) -> List[int]:
+    return [i for i, wd in enumerate(WEEKDAYS) if (schedule or {}).get(wd)]
+
+def _gap_free(last: date, day: date, scheduled: Iterable[int]) -> bool:
+    """Nenhum dia de rotina estritamente entre `last` e `day` (no máx. 7 passos)."""
+    sched = set(scheduled)
+    if not sched: return (day - last).days <= 1
+    d = last + timedelta(days=1)
+    while d < day:
+        if d.weekday() in sched: return False
+        d += timedelta(days=1)
+    return True
+
+def record_day_done(user: Dict[str, Any], day_key: str) -> None:
+    """Dia concluído (chamar só na transição para feito). A sequência conta dias
+    de rotina seguidos: dias fora da rotina não quebram."""
+    r = _roll(user)
+    last = r.get("last_done")
+    if last == day_key: return
+    day = date.fromisoformat(day_key)
+    _bump(r["weeks"], week_key(day), KEEP_WEEKS)
+    _bump(r["months"], day_key[:7], KEEP_MONTHS)
+    if last and last < day_key and _gap_free(date.fromisoformat(last), day, _scheduled(user.get("schedule") or {})):
+        r["streak"] = int(r.get("streak", 0)) + 1
+    else:
+        r["streak"] = 1
+    r["best"] = max(int(r.get("best", 0)), r["streak"])
+    r["last_done"] = day_key
+
+def current_streak(user: Dict[str, Any], today: str) -> int:
+    """Sequência ainda viva hoje: o dia de hoje em aberto não a quebra."""
+    r = user.get("rollup") or {}
+    last = r.get("last_done")
+    if not last: return 0
+    if last >= today: return int(r.get("streak", 0))
+    ok = _gap_free(date.fromisoformat(last), date.fromisoformat(today), _scheduled(user.get("schedule") or {}))
+    return int(r.get("streak", 0)) if ok else 0
+
+def summary(user: Dict[str, Any], today: str) -> Dict[str, Any]:
+    r = user.get("rollup") or {}
+    day = date.fromisoformat(today)
+    return {
+        "week": int((r.get("weeks") or {}).get(week_key(day), 0)),
+        "month": int((r.get("months") or {}).get(today[:7], 0)),
+        "streak": current_streak(user, today),
+        "best": int(r.get("best", 0)),
+        "lessons": int(r.get("lessons", 0)),
+        "ops": {op: dict(e) for op, e in (r.get("ops") or {}).items()},
+    }
+
+def digest_day(today: str) -> str:
+    """Domingo que fecha a semana do resumo: hoje, se for domingo; senão o anterior."""
+    day = date.fromisoformat(today)
+    return (day - timedelta(days=(day.weekday() + 1) % 7)).isoformat()
+
+def _rate(e: Dict[str, Any]) -> Optional[int]:
+    return round(100.0 * e["hits"] / e["q"]) if e.get("q") else None
+
+def report_text(name: str, s: Dict[str, Any], weekly: bool = False) -> str:
+    """Texto do relatório (comando) ou do resumo semanal (weekly=True)."""
+    head = f"Resumo da semana de {name}" if weekly else f"Relatório de {name}"
+    lines = [head,
+             f"- Dias feitos na semana: {s['week']}",
+             f"- Dias feitos no mês: {s['month']}",
+             f"- Sequência atual: {s['streak']} (recorde {s['best']})"]
+    ops = [(op, _rate(e), e) for op, e in sorted(s["ops"].items(), key=lambda kv: _OP_ORDER.get(kv[0], 99))]
+    ops = [(op, rate, e) for op, rate, e in ops if rate is not None]
+    if ops:
+        lines.append("Acertos por matéria:")
+        for op, rate, e in ops:
+            lines.append(f"- {OP_NAMES.get(op, op)}: {rate}% ({e['hits']}/{e['q']}; tentativas: {e['tries']})")
+    else:
+        lines.append("Ainda sem aulas registradas.")
+    return "\n".join(lines)
@@ -4,13 +4,26 @@
 
 import os
 import re
+import json
 import random
-from typing import Any, Dict, Optional, Tuple, List
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, List
 from datetime import datetime, timedelta, time as dtime
 
 from flask import Flask, request, Response, jsonify
 
-from storage import load_db, save_db
+from storage import DB_PATH, STORAGE_BACKEND
+from storage import (get_user, put_user, put_users, delete_user, user_keys, iter_users, user_lock,
+                     find_user_by_phone, index_phones, index_users, user_phones,
+                     index_schedule, schedule_deadlines, due_checkins, mark_checked,
+                     next_deadline, acquire_lease, get_meta, put_meta, db_size_bytes,
+                     note_event, reset_events, get_store, CachedStore)
 
 try:
     from progress import init_user_if_needed  # type: ignore
@@ -20,6 +33,19 @@ except Exception:
 
 from twilio.twiml.messaging_response import MessagingResponse
 from twilio.rest import Client
+from twilio.base.exceptions import TwilioRestException
+
+from outbox import Outbox, FakeTwilioClient, PermanentSendError
+from notifications import CheckinScheduler
+from retention import compact_daily_state, archive_days
+import question_bank
+import skill
+import transfer
+import rollups
+from digest import DigestDispatcher, Message, TokenBucket
+from metrics import registry as _metrics
+from idempotency import ReplyCache
+from tenants import Tenant, load_tenants
 
 try:
     from zoneinfo import ZoneInfo  # Python 3.9+
@@ -45,18 +71,60 @@ TWILIO_AUTH_TOKEN  = os.getenv("TWILIO_AUTH_TOKEN", "")
 WHATSAPP_FROM = os.getenv("WHATSAPP_FROM", "")
 TWILIO_FROM = os.getenv("TWILIO_FROM", "") or WHATSAPP_FROM
 
-_twilio_client: Optional[Client] = None
-def _get_twilio() -> Client:
+# Vários números no mesmo processo: TENANTS_FILE (JSON) lista number,
+# namespace, name, twilio_from, tz e flags de cada um. O tenant padrão (sem
+# namespace, chaves legadas) vem das variáveis acima; o número fica só com
+# dígitos, como o `To` das mensagens.
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+TENANTS = load_tenants(TENANTS_FILE, Tenant(
+    number=re.sub(r"\D+", "", os.getenv("BOT_NUMBER", "")), name=os.getenv("ASSISTANT_NAME", "MARIA ANGELA"),
+    twilio_from=TWILIO_FROM, tz=PROJECT_TZ,
+    feature_portugues=FEATURE_PORTUGUES, feature_leitura=FEATURE_LEITURA))
+_tenant_local = threading.local()
+
+def _tenant() -> Tenant:
+    """Tenant da mensagem/usuário em processamento nesta thread."""
+    return getattr(_tenant_local, "t", None) or TENANTS.default
+
+class _using_tenant:
+    def __init__(self, t: Tenant): self.t = t
+    def __enter__(self) -> Tenant:
+        self.prev = getattr(_tenant_local, "t", None)
+        _tenant_local.t = self.t
+        return self.t
+    def __exit__(self, *exc: Any) -> None:
+        _tenant_local.t = self.prev
+
+# Endpoints de dados (/admin/export, /admin/import): senha via Basic auth ou
+# header X-Admin-Pass. Vazio = endpoints desligados.
+ADMIN_PASS = os.getenv("ADMIN_PASS", "")
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "200"))
+
+# TWILIO_FAKE=True usa um cliente em memória (testes/dev offline).
+TWILIO_FAKE = os.getenv("TWILIO_FAKE", "False") == "True"
+
+# Fila de saída: envios proativos saem do request e vão para workers.
+OUTBOX_ASYNC = os.getenv("OUTBOX_ASYNC", "True") == "True"
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", os.path.join(os.path.dirname(DB_PATH) or "data", "outbox.json"))
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+
+_twilio_client: Optional[Any] = None
+def _get_twilio() -> Any:
     global _twilio_client
     if _twilio_client is None:
-        _twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+        _twilio_client = FakeTwilioClient() if TWILIO_FAKE else Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
     return _twilio_client
 
 # ==================
 # Helpers de sistema
 # ==================
+@lru_cache(maxsize=64)
+def _zone(name: str) -> Optional[ZoneInfo]:
+    return ZoneInfo(name) if ZoneInfo else None
+
 def _tz() -> Optional[ZoneInfo]:
-    return ZoneInfo(PROJECT_TZ) if ZoneInfo else None
+    return _zone(_tenant().tz)
 
 def _now() -> datetime:
     z = _tz()
@@ -66,8 +134,15 @@ def _today_str(dt: Optional[datetime] = None) -> str:
     dt = dt or _now()
     return dt.strftime("%Y-%m-%d")
 
+_RE_NON_DIGITS = re.compile(r"\D+")
+_RE_HHMM = re.compile(r"^\s*(\d{1,2}):(\d{2})\s*$")
+_RE_HOUR_LOOSE = re.compile(r"^\s*(\d{1,2})\s*(h|pm|am)?\s*$")
+_RE_INT2 = re.compile(r"^\s*(\d{1,2})\s*$")
+_RE_CHOICE_1_4 = re.compile(r"^\s*([1-4])\s*$")
+_RE_CHOICE_1_5 = re.compile(r"^\s*([1-5])\s*$")
+
 def _digits_only(s: Optional[str]) -> str:
-    return re.sub(r"\D+", "", s or "")
+    return _RE_NON_DIGITS.sub("", s or "")
 
 def _numbers_match(a: Optional[str], b: Optional[str]) -> bool:
     return _digits_only(a) == _digits_only(b)
@@ -77,7 +152,7 @@ def _weekday_key(dt: Optional[datetime] = None) -> str:
     return ["mon","tue","wed","thu","fri","sat","sun"][dt.weekday()]
 
 def _parse_hhmm_strict(s: str) -> Optional[dtime]:
-    m = re.match(r"^\s*(\d{1,2}):(\d{2})\s*$", s or "")
+    m = _RE_HHMM.match(s or "")
     if not m:
         return None
     hh, mm = int(m.group(1)), int(m.group(2))
@@ -89,7 +164,7 @@ def _parse_time_loose(s: str) -> Optional[dtime]:
     s = (s or "").strip().lower()
     t = _parse_hhmm_strict(s)
     if t: return t
-    m = re.match(r"^\s*(\d{1,2})\s*(h|pm|am)?\s*$", s)
+    m = _RE_HOUR_LOOSE.match(s)
     if m:
         hh = int(m.group(1))
         suf = (m.group(2) or "").lower()
@@ -129,7 +204,7 @@ def _choice_to_index(body: str) -> Optional[int]:
     b = (body or "").strip().lower()
     if b in ("a","b","c","d"):
         return ord(b) - ord("a")
-    m = re.match(r"^\s*([1-4])\s*$", b)
+    m = _RE_CHOICE_1_4.match(b)
     if m:
         return int(m.group(1)) - 1
     return None
@@ -141,13 +216,23 @@ def _options_with_letters(options: List[str]) -> str:
 # ===========================
 # DB layout e acesso a usuário
 # ===========================
-def _db() -> Dict[str, Any]:
-    d = load_db()
-    d.setdefault("users", {})
-    return d
+def _load_user(key: str) -> Optional[Dict[str, Any]]:
+    with _metrics.timer("storage_seconds", op="get_user"):
+        return get_user(key)
+
+def _put_user(key: str, user: Dict[str, Any]) -> None:
+    with _metrics.timer("storage_seconds", op="put_user"):
+        put_user(key, user)
 
-def _save(d: Dict[str, Any]) -> None:
-    save_db(d)
+def _delete_user(key: str) -> None:
+    with _metrics.timer("storage_seconds", op="delete_user"):
+        delete_user(key)
+
+def _index_user(key: str, user: Dict[str, Any]) -> None:
+    """Atualiza os índices derivados do cadastro (telefones e prazos de check-in)."""
+    index_phones(key, user_phones(user, key))
+    index_schedule(key, schedule_deadlines(user))
+    if _scheduler: _scheduler.poke()
 
 GRADES = ["Infantil 4 (Pré-I)","Infantil 5 (Pré-II)","1º ano","2º ano","3º ano","4º ano","5º ano"]
 
@@ -158,21 +243,19 @@ SCHEDULE_ORDER: List[Tuple[str, str]] = [
 def _default_schedule() -> Dict[str, Optional[str]]:
     return {k: ("19:00" if k != "sun" else None) for k,_ in SCHEDULE_ORDER}
 
-def _get_or_create_user(d: Dict[str, Any], sender: str) -> Tuple[str, Dict[str, Any]]:
-    key = _digits_only(sender)
-    users: Dict[str, Dict[str, Any]] = d["users"]
-    if key in users:
-        return key, users[key]
-    for k, user in users.items():
-        prof = (user.get("profile") or {})
-        if _numbers_match(sender, prof.get("child_phone")):
-            return k, user
-        for g in (prof.get("guardians") or []):
-            if _numbers_match(sender, g):
-                return k, user
-    user: Dict[str, Any] = {
+def _resolve_user_key(sender: str) -> str:
+    """Chave do registro do remetente (no tenant atual): o próprio número ou o
+    dono dele no índice."""
+    key = _tenant().key(_digits_only(sender))
+    if key and _load_user(key) is None:
+        owner = find_user_by_phone(key)
+        if owner: return owner
+    return key
+
+def _new_user(sender: str) -> Dict[str, Any]:
+    return {
         "profile": {
-            "timezone": PROJECT_TZ,
+            "timezone": _tenant().tz,
             "child_phone": None,
             "guardians": [sender],
             "child_name": None,
@@ -182,10 +265,8 @@ def _get_or_create_user(d: Dict[str, Any], sender: str) -> Tuple[str, Dict[str,
         "schedule": _default_schedule(),
         "daily_state": {},
         "wizard": None,
-        "lesson": None,     # {"idx": int, "q": List[Q], "hits": int, "tries": {idx: n}}
+        "lesson": None,     # {"seed": int, "items": [id], "idx": int, "hits": int, "tries": {"idx": n}}
     }
-    users[key] = user
-    return key, user
 
 def _is_from_guardian(sender: str, user: Dict[str, Any]) -> bool:
     for g in (user.get("profile") or {}).get("guardians", []) or []:
@@ -195,26 +276,61 @@ def _is_from_guardian(sender: str, user: Dict[str, Any]) -> bool:
 # ================
 # Notificações
 # ================
-def _get_twilio_enabled() -> bool:
-    return bool(TWILIO_FROM and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN)
+def _get_twilio_enabled(from_: str = "") -> bool:
+    return TWILIO_FAKE or bool((from_ or _tenant().twilio_from) and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN)
 
-def _send_whatsapp(to_number: str, body: str) -> None:
-    if not _get_twilio_enabled(): return
+def _deliver_whatsapp(to_number: str, body: str, from_: str = "") -> None:
+    """Envio de fato (bloqueia no REST do Twilio). Chamado pelos workers da fila."""
     client = _get_twilio()
     to_fmt = to_number if to_number.startswith("whatsapp:") else f"whatsapp:+{_digits_only(to_number)}"
-    client.messages.create(from_=TWILIO_FROM, to=to_fmt, body=body)
+    try:
+        client.messages.create(from_=from_ or TWILIO_FROM, to=to_fmt, body=body)
+    except TwilioRestException as e:
+        # 4xx (exceto 429) não melhora com retry
+        if 400 <= int(e.status or 0) < 500 and e.status != 429:
+            raise PermanentSendError(str(e)) from e
+        raise
+
+_outbox: Optional[Outbox] = None
+_outbox_lock = threading.Lock()
+def _get_outbox() -> Outbox:
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = Outbox(OUTBOX_PATH, _deliver_whatsapp, workers=OUTBOX_WORKERS,
+                                 max_attempts=OUTBOX_MAX_ATTEMPTS,
+                                 rate_limits={"digest": _digest_bucket}).start()
+    return _outbox
+
+def _send_whatsapp(to_number: str, body: str, from_: str = "", lane: str = "") -> None:
+    """Envia pelo número do tenant atual (ou `from_`, quando fora do contexto dele).
+    `lane`: limite de ritmo do outbox aplicado na entrega (ex. "digest")."""
+    from_ = from_ or _tenant().twilio_from
+    if not _get_twilio_enabled(from_): return
+    with _metrics.timer("whatsapp_send_seconds", mode="outbox" if OUTBOX_ASYNC else "direct"):
+        if OUTBOX_ASYNC:
+            _get_outbox().enqueue(to_number, body, from_, lane=lane)
+        else:
+            _deliver_whatsapp(to_number, body, from_)
 
-def _notify_done(user: Dict[str, Any], day_key: str, late: bool = False) -> None:
+def _done_messages(user: Dict[str, Any], late: bool = False) -> List[Tuple[str, str]]:
     name = ((user.get("profile") or {}).get("child_name") or "A criança")
     msg = f"{name} concluiu{' agora' if late else ''} as atividades de hoje. Bom trabalho!"
-    for g in (user.get("profile") or {}).get("guardians", []) or []:
-        _send_whatsapp(g, msg)
+    return [(g, msg) for g in (user.get("profile") or {}).get("guardians", []) or []]
 
-def _notify_miss(user: Dict[str, Any], day_key: str) -> None:
+def _miss_messages(user: Dict[str, Any]) -> List[Tuple[str, str]]:
     name = ((user.get("profile") or {}).get("child_name") or "A criança")
     msg = f"{name} ainda não concluiu as atividades de hoje. Precisa de ajuda para finalizar?"
-    for g in (user.get("profile") or {}).get("guardians", []) or []:
-        _send_whatsapp(g, msg)
+    return [(g, msg) for g in (user.get("profile") or {}).get("guardians", []) or []]
+
+def _notify_done(user: Dict[str, Any], day_key: str, late: bool = False) -> None:
+    for to, msg in _done_messages(user, late=late):
+        _send_whatsapp(to, msg)
+
+def _notify_miss(user: Dict[str, Any], day_key: str) -> None:
+    for to, msg in _miss_messages(user):
+        _send_whatsapp(to, msg)
 
 # ======================
 # Check-in Diário (core)
@@ -228,15 +344,25 @@ def _get_day_state(user: Dict[str, Any], day_key: str) -> Dict[str, Any]:
     st.setdefault("miss_notified", False)
     return st
 
+_DAY_DEFAULTS = {"done": False, "done_ts": None, "done_notified": False, "miss_notified": False}
+
+def _peek_day_state(user: Dict[str, Any], day_key: str) -> Dict[str, Any]:
+    """Como _get_day_state, mas só leitura: não cria o dia no registro."""
+    return {**_DAY_DEFAULTS, **((user.get("daily_state") or {}).get(day_key) or {})}
+
 def mark_day_done(user: Dict[str, Any], when: Optional[datetime] = None) -> Tuple[str, Dict[str, Any]]:
     when = when or _now()
     day_key = _today_str(when)
     st = _get_day_state(user, day_key)
+    if not st["done"]:
+        note_event("day_done", day=day_key)
+        rollups.record_day_done(user, day_key)
     st["done"] = True
     if not st["done_ts"]: st["done_ts"] = when.isoformat()
     if not st.get("done_notified", False):
         _notify_done(user, day_key, late=bool(st.get("miss_notified", False)))
         st["done_notified"] = True
+        note_event("notified", kind="done", day=day_key)
     return day_key, st
 
 def _get_today_reminder_dt(user: Dict[str, Any], base_dt: Optional[datetime] = None) -> Optional[datetime]:
@@ -249,25 +375,35 @@ def _get_today_reminder_dt(user: Dict[str, Any], base_dt: Optional[datetime] = N
     if not t: return None
     return _combine_date_time(base_dt, t)
 
-def process_checkin_cron(user: Dict[str, Any], now_dt: Optional[datetime] = None) -> Optional[str]:
-    now_dt = now_dt or _now()
-    day_key = _today_str(now_dt)
-    st = _get_day_state(user, day_key)
+def _cron_plan(user: Dict[str, Any], now_dt: datetime) -> str:
+    """Decide o que o check-in faria agora, sem mexer no usuário nem enviar nada."""
+    st = (user.get("daily_state") or {}).get(_today_str(now_dt)) or {}
     rem_dt = _get_today_reminder_dt(user, base_dt=now_dt)
     if rem_dt is None: return "skip:no-schedule"
     deadline = rem_dt + timedelta(hours=3)
-    if st["done"]:
-        if not st.get("done_notified", False):
-            _notify_done(user, day_key, late=bool(st.get("miss_notified", False)))
-            st["done_notified"] = True
-            return "sent:done"
-        return "skip:already-done-notified"
+    if st.get("done"):
+        return "sent:done" if not st.get("done_notified", False) else "skip:already-done-notified"
     if now_dt >= deadline and not st.get("miss_notified", False):
-        _notify_miss(user, day_key)
-        st["miss_notified"] = True
         return "sent:miss"
     return "skip:not-due"
 
+def _cron_apply(user: Dict[str, Any], now_dt: datetime, tag: str) -> List[Tuple[str, str]]:
+    """Aplica as flags do plano e devolve as mensagens a enviar (to, body)."""
+    if tag not in ("sent:done", "sent:miss"): return []
+    st = _get_day_state(user, _today_str(now_dt))
+    if tag == "sent:done":
+        st["done_notified"] = True
+        return _done_messages(user, late=bool(st.get("miss_notified", False)))
+    st["miss_notified"] = True
+    return _miss_messages(user)
+
+def process_checkin_cron(user: Dict[str, Any], now_dt: Optional[datetime] = None) -> Optional[str]:
+    now_dt = now_dt or _now()
+    tag = _cron_plan(user, now_dt)
+    for to, msg in _cron_apply(user, now_dt, tag):
+        _send_whatsapp(to, msg)
+    return tag
+
 # ======================
 # Aula — 5 rodadas fixas + tentativas/dica
 # ======================
@@ -284,79 +420,73 @@ def _hint_for(q: Dict[str, Any]) -> str:
         return f"Quantas vezes {b} cabe em {a}? Pense na tabuada do {b}."
     return "Pense no que a operação está pedindo e revise as opções."
 
-def _build_math_question(op: Optional[str] = None) -> Dict[str, Any]:
+def _build_math_question(op: Optional[str] = None, rng: Any = random, level: int = 1) -> Dict[str, Any]:
     if op == "mix" or op is None:
-        op = random.choice(["+", "-", "*", "/"])
-
-    if op == "+":
-        a, b = random.randint(2, 9), random.randint(2, 9)
-        correct = a + b
-        prompt = f"Quanto é {a} + {b}?"
-        pool = list(range(max(0, correct - 4), correct + 5))
-        pool = [x for x in pool if x >= 0]
-    elif op == "-":
-        a, b = random.randint(2, 9), random.randint(2, 9)
-        if b > a: a, b = b, a
-        correct = a - b
-        prompt = f"Quanto é {a} - {b}?"
-        pool = list(range(max(0, correct - 4), correct + 5))
-    elif op == "*":
-        a, b = random.randint(2, 9), random.randint(2, 9)
-        correct = a * b
-        prompt = f"Quanto é {a} × {b}?"
-        pool = [correct + d for d in (-6,-4,-3,-2,-1,1,2,3,4,6) if correct + d > 0]
-    elif op == "/":
-        b = random.randint(2, 9)
-        q = random.randint(2, 9)
-        a = b * q
-        correct = q
-        prompt = f"Quanto é {a} ÷ {b}?"
-        pool = [max(1, correct + d) for d in (-3,-2,-1,1,2,3)]
-    else:
-        a, b, correct, prompt, pool = 2, 2, 4, "Quanto é 2 + 2?", [1,2,3,4,5,6]
-
-    opts = {correct}
-    random.shuffle(pool)
-    for v in pool:
-        if len(opts) >= 4: break
-        if v != correct: opts.add(v)
-    options = list(opts)
-    random.shuffle(options)
-    answer_idx = options.index(correct)
-
-    return {
-        "type": "math",
-        "op": op,
-        "a": a,
-        "b": b,
-        "prompt": prompt,
-        "options": [str(x) for x in options],
-        "answer": answer_idx  # 0..3
-    }
+        op = rng.choice(["+", "-", "*", "/"])
+    return question_bank.question(question_bank.draw(op, level, rng), rng)
+
+# Aula compacta: no registro vão só a semente e os ids dos itens do banco
+# ({"seed": int, "items": [id, ...], "idx", "hits", "tries"}); cada pergunta é
+# regenerada sob demanda com random.Random(semente, rodada), então a mesma
+# semente produz sempre o mesmo texto e as mesmas opções (o dict devolvido é
+# compartilhado pelo cache: só leitura).
+PLAN_OPS = {"+": "+", "-": "-", "*": "*", "/": "/", "x": "mix"}
+
+@lru_cache(maxsize=4096)
+def _question_for(seed: int, idx: int, item: int) -> Dict[str, Any]:
+    return question_bank.question(item, random.Random(seed * 64 + idx))
+
+@lru_cache(maxsize=1024)
+def _plan_question_for(seed: int, idx: int, kind: str) -> Dict[str, Any]:
+    rng = random.Random(seed * 64 + idx)
+    if kind == "p":
+        return _build_pt_question(rng)
+    return _build_math_question(PLAN_OPS.get(kind, "mix"), rng)
+
+def _lesson_len(les: Dict[str, Any]) -> int:
+    if "q" in les: return len(les.get("q") or [])  # formatos antigos: perguntas inteiras
+    if "plan" in les: return len(les.get("plan") or "")  # ou plano de rodadas
+    return len(les.get("items") or [])
+
+def _lesson_question(les: Dict[str, Any], idx: int) -> Dict[str, Any]:
+    if "q" in les: return les["q"][idx]
+    if "plan" in les: return _plan_question_for(int(les["seed"]), idx, les["plan"][idx])
+    return _question_for(int(les["seed"]), idx, int(les["items"][idx]))
+
+def _grade_level(user: Dict[str, Any]) -> int:
+    return skill.grade_level((user.get("profile") or {}).get("grade"))
+
+def _lesson_tries(les: Dict[str, Any], idx: int) -> int:
+    return int((les.get("tries") or {}).get(str(idx), 0))
 
 def _start_lesson(user: Dict[str, Any]) -> str:
     # Sessao do dia:
     # 1) Matematica: 5 rodadas fixas (soma, subtracao, multiplicacao, divisao, mistura)
     # 2) Portugues: PT_ROUNDS_PER_DAY rodadas (se FEATURE_PORTUGUES=True)
-    ops_order = ["+", "-", "*", "/", "mix"]
-    qts: List[Dict[str, Any]] = [_build_math_question(op) for op in ops_order]
-
-    if FEATURE_PORTUGUES:
-        for _ in range(max(1, PT_ROUNDS_PER_DAY)):
-            qts.append(_build_pt_question())
-
-    user["lesson"] = {"idx": 0, "q": qts, "hits": 0, "tries": {}}
+    # Itens sorteados sem repetir entre dias (bitset em user["bank_seen"]),
+    # no nível que a estimativa de habilidade (skill.py) indica para cada op.
+    base = _grade_level(user)
+    seen = question_bank.seen_from_hex(user.get("bank_seen"))
+    ops_order = ["+", "-", "*", "/", random.choice(question_bank.MATH_OPS)]
+    items = [question_bank.draw(op, skill.pick_level(user, op, base), random, seen) for op in ops_order]
+
+    if _tenant().feature_portugues:
+        for _ in range(max(1, min(PT_ROUNDS_PER_DAY, len(question_bank.bucket("pt", 1))))):
+            items.append(question_bank.draw("pt", 1, random, seen))
+
+    user["bank_seen"] = question_bank.seen_to_hex(seen)
+    user["lesson"] = {"seed": random.getrandbits(31), "items": items, "idx": 0, "hits": 0, "tries": {}}
+    note_event("lesson_started", questions=len(items), seed=user["lesson"]["seed"])
     return _present_current_question(user)
 
 def _present_current_question(user: Dict[str, Any]) -> str:
     les = user.get("lesson") or {}
     idx = int(les.get("idx", 0))
-    qts: List[Dict[str, Any]] = les.get("q") or []
-    if idx >= len(qts):
+    if idx >= _lesson_len(les):
         return _finish_lesson(user)
 
-    q = qts[idx]
-    tries = int((les.get("tries") or {}).get(idx, 0))
+    q = _lesson_question(les, idx)
+    tries = _lesson_tries(les, idx)
 
     if q.get("type") == "pt":
         header = "PORTUGUES"
@@ -370,30 +500,42 @@ def _present_current_question(user: Dict[str, Any]) -> str:
 def _apply_answer(user: Dict[str, Any], body: str) -> str:
     les = user.get("lesson") or {}
     idx = int(les.get("idx", 0))
-    qts: List[Dict[str, Any]] = les.get("q") or []
-    if not qts or idx >= len(qts):
+    if idx >= _lesson_len(les):
         return "Nao ha aula em andamento. Digite comecar aula."
 
     choice = _choice_to_index(body)
     if choice is None:
         return "Responda apenas com a, b, c ou d."
 
-    q = qts[idx]
+    q = _lesson_question(les, idx)
     correct_idx = int(q["answer"])
+    note_event("answer", idx=idx, choice=choice, correct=choice == correct_idx)
+
+    # habilidade: atualiza no acerto ou quando a pergunta se esgota (3 erros)
+    tries_before = _lesson_tries(les, idx)
+    resolved = choice == correct_idx or tries_before + 1 >= 3
+    rollups.record_answer(user, q.get("op") or q.get("type") or "mix", choice == correct_idx, resolved)
+    if "item" in q and resolved:
+        item = int(q["item"])
+        op, level = question_bank.OP[item], question_bank.LEVEL[item]
+        score = skill.score_for(tries_before, choice == correct_idx)
+        skill.update(user, op, level, score, _grade_level(user))
+        note_event("skill", op=op, level=level, score=score)
 
     # acertou
     if choice == correct_idx:
         les["hits"] = int(les.get("hits", 0)) + 1
-        tries_map: Dict[int, int] = les.setdefault("tries", {})
-        tries_map.pop(idx, None)
+        tries_map: Dict[str, int] = les.setdefault("tries", {})
+        tries_map.pop(str(idx), None)
         les["idx"] = idx + 1
         user["lesson"] = les
         return _present_current_question(user)
 
     # errou
-    tries_map2: Dict[int, int] = les.setdefault("tries", {})
-    t = int(tries_map2.get(idx, 0)) + 1
-    tries_map2[idx] = t
+    # chaves em str: o JSON converteria int em str e a contagem zeraria a cada mensagem
+    tries_map2: Dict[str, int] = les.setdefault("tries", {})
+    t = tries_before + 1
+    tries_map2[str(idx)] = t
     user["lesson"] = les
 
     # 3a tentativa: mostra correta e segue
@@ -401,7 +543,7 @@ def _apply_answer(user: Dict[str, Any], body: str) -> str:
         letters = ["a", "b", "c", "d"]
         correct_val = q["options"][correct_idx]
         les["idx"] = idx + 1
-        tries_map2.pop(idx, None)
+        tries_map2.pop(str(idx), None)
         user["lesson"] = les
         return f"Nao foi dessa vez. A correta era {letters[correct_idx]}) {correct_val}.\n" + _present_current_question(user)
 
@@ -409,24 +551,18 @@ def _apply_answer(user: Dict[str, Any], body: str) -> str:
 
 def _finish_lesson(user: Dict[str, Any]) -> str:
     les = user.get("lesson") or {}
-    total = len(les.get("q") or [])
+    total = _lesson_len(les)
     hits = int(les.get("hits", 0))
     user["lesson"] = None
+    rollups.record_lesson(user)
     mark_day_done(user, when=_now())
     return f"Aula concluída! Acertos: {hits}/{total}.\nQuer ver o *status* do dia?"
 
 # ======================
 # Português (mantido para futuro)
 # ======================
-def _build_pt_question() -> Dict[str, Any]:
-    qs = [
-        ("Qual está escrito corretamente?", ["Exceção", "Excessão", "Eceção", "Ecessão"], 0),
-        ("Qual plural está correto para *pão*?", ["pãos", "pães", "pãoses", "pãeses"], 1),
-        ("Qual forma está correta?", ["A gente vamos", "A gente vai", "Nós vai", "Nós vamos ir"], 1),
-        ("Complete: Ela ___ ao mercado ontem.", ["vai", "foi", "iria", "vou"], 1),
-    ]
-    prompt, options, ans = random.choice(qs)
-    return {"type": "pt", "prompt": prompt, "options": options, "answer": ans}
+def _build_pt_question(rng: Any = random) -> Dict[str, Any]:
+    return question_bank.question(question_bank.draw("pt", 1, rng), rng)
 
 # ======================
 # Onboarding (wizard) — com atalho "ok"
@@ -434,21 +570,22 @@ def _build_pt_question() -> Dict[str, Any]:
 def _start_wizard(user: Dict[str, Any]) -> str:
     user["wizard"] = {"step": "ask_name", "tmp": {}}
     return (
-        "Oi! Eu sou a MARIA ANGELA  sua assistente de aula.\n"
+        f"Oi! Eu sou a {_tenant().name}  sua assistente de aula.\n"
         "Vou te acompanhar em atividades de Matemática, Português"
-        f"{' e Leitura' if FEATURE_LEITURA else ''}.\n\n"
-        "Pra começar, me diga: *qual é o nome da criança?*"
+        f"{' e Leitura' if _tenant().feature_leitura else ''}.\n\n" + WIZARD_STEPS["ask_name"].prompt
     )
 
-def _wizard_prompt_grade() -> str:
-    opts = "\n".join([f"{i+1}) {GRADES[i]}" for i in range(len(GRADES))])
-    return ("E em qual série/ano ela está?\n"
-            "Responda o número ou escreva:\n" + opts)
-
-def _wizard_prompt_yesno_domingo() -> str:
-    return ("Perfeito!  A rotina é segunda a sábado por padrão.\n"
-            "Deseja incluir domingo também?\n"
-            "1) sim   2) não   (ou responda *ok* para 'não')")
+_PROMPT_GRADE = ("E em qual série/ano ela está?\n"
+                 "Responda o número ou escreva:\n" + "\n".join(f"{i+1}) {g}" for i, g in enumerate(GRADES)))
+_PROMPT_CHILD_WHATSAPP = ("A criança tem um número próprio de WhatsApp?\n"
+                          "Envie no formato +55 DDD XXXXX-XXXX ou responda *não tem* (ou *ok* para 'não tem').")
+_PROMPT_GUARDIANS = ("Agora, o(s) número(s) do(s) responsável(is) (1 ou 2), separados por vírgula.\n"
+                     "Ex.: +55 71 98888-7777, +55 71 97777-8888\n"
+                     "(ou responda *ok* para manter só o seu número)")
+_PROMPT_SUNDAY = ("Perfeito!  A rotina é segunda a sábado por padrão.\n"
+                  "Deseja incluir domingo também?\n"
+                  "1) sim   2) não   (ou responda *ok* para 'não')")
+_TIME_CHOICES = {1: "08:00", 2: "18:30", 3: "19:00", 4: "20:00"}
 
 def _wizard_prompt_time_for(day_pt: str) -> str:
     return (f"Qual horário para *{day_pt}*? (faixa 05:00–21:30)\n"
@@ -478,150 +615,180 @@ def _wizard_confirm(user: Dict[str, Any], tmp: Dict[str, Any]) -> str:
         "Responda *sim* para salvar, ou *não* para ajustar. (ou *ok* para salvar)"
     )
 
-def _handle_wizard(user: Dict[str, Any], body: str) -> Optional[str]:
-    wz = user.get("wizard")
-    if not wz: return None
-    step = wz.get("step")
-    tmp = wz.setdefault("tmp", {})
-
-    if step == "ask_name":
-        name = body.strip()
-        if len(name) < 2:
-            return "Digite um nome válido (mín. 2 letras). Qual é o nome da criança?"
-        tmp["child_name"] = name
-        wz["step"] = "ask_age"
-        return f"Perfeito, {name}! \nQuantos anos ela tem?"
-
-    if step == "ask_age":
-        m = re.match(r"^\s*(\d{1,2})\s*$", body)
-        if not m:
-            return "Me diga um número (ex.: 9). Quantos anos ela tem?"
-        age = int(m.group(1))
-        if not (3 <= age <= 17): return "Idade fora do padrão (3–17). Tente novamente."
-        tmp["child_age"] = age
-        wz["step"] = "ask_grade"
-        return _wizard_prompt_grade()
-
-    if step == "ask_grade":
-        n = re.match(r"^\s*(\d{1,2})\s*$", body)
-        if n:
-            idx = int(n.group(1)) - 1
-            if 0 <= idx < len(GRADES): tmp["grade"] = GRADES[idx]
-            else: return _wizard_prompt_grade()
-        else:
-            txt = body.strip().lower()
-            chosen = None
-            for g in GRADES:
-                if txt in g.lower(): chosen = g; break
-            if not chosen: return _wizard_prompt_grade()
-            tmp["grade"] = chosen
-        wz["step"] = "ask_child_whatsapp"
-        return ("A criança tem um número próprio de WhatsApp?\n"
-                "Envie no formato +55 DDD XXXXX-XXXX ou responda *não tem* (ou *ok* para 'não tem').")
-
-    if step == "ask_child_whatsapp":
-        b = body.strip().lower()
-        if _is_ok(b) or "não tem" in b or "nao tem" in b or b in ("nao","não","n"):
-            tmp["child_phone"] = None
-        else:
-            d = _digits_only(body)
-            if not d:
-                return "Envie o WhatsApp da criança no formato +55 DDD XXXXX-XXXX ou responda *não tem*."
-            tmp["child_phone"] = d
-        wz["step"] = "ask_guardians"
-        return ("Agora, o(s) número(s) do(s) responsável(is) (1 ou 2), separados por vírgula.\n"
-                "Ex.: +55 71 98888-7777, +55 71 97777-8888\n"
-                "(ou responda *ok* para manter só o seu número)")
-
-    if step == "ask_guardians":
-        if _is_ok(body):
-            sender = (user.get("profile") or {}).get("guardians", [None])[0]
-            tmp["guardians"] = [g for g in [sender] if g]
-        else:
-            gs = _parse_phones_list(body)
-            sender = (user.get("profile") or {}).get("guardians", [])[0]
-            if sender and _digits_only(sender) not in [_digits_only(x) for x in gs]:
-                gs = [sender] + gs
-            tmp["guardians"] = list(dict.fromkeys(gs))[:2]
-        wz["step"] = "ask_sunday"
-        return _wizard_prompt_yesno_domingo()
-
-    if step == "ask_sunday":
-        if _is_ok(body): yn = False
-        else:
-            yn = _yes_no(body)
-            if yn is None: return _wizard_prompt_yesno_domingo()
-        tmp.setdefault("schedule", _default_schedule())
-        tmp["schedule"]["sun"] = tmp["schedule"]["sun"] if yn else None
-        wz["step"] = "ask_time_mon"
-        return _wizard_prompt_time_for("seg")
+class _Reject(Exception):
+    """Resposta inválida: a mensagem vai para o usuário e o passo se repete."""
+
+@dataclass(frozen=True)
+class _WizardStep:
+    """Um passo do cadastro.
+
+    - `prompt`: pergunta feita ao entrar no passo (texto pronto ou função de (user, tmp))
+    - `parse(user, body)`: valor lido da resposta; levanta _Reject(texto) se inválida
+    - `save(user, tmp, valor)`: grava o valor; se devolver texto, ele encerra o passo
+      (confirmação) em vez de seguir para `next`
+    """
+    prompt: Any
+    parse: Callable[[Dict[str, Any], str], Any]
+    save: Callable[[Dict[str, Any], Dict[str, Any], Any], Optional[str]]
+    next: Optional[str] = None
+
+def _set_tmp(field: str) -> Callable[[Dict[str, Any], Dict[str, Any], Any], None]:
+    def save(user: Dict[str, Any], tmp: Dict[str, Any], value: Any) -> None:
+        tmp[field] = value
+    return save
+
+def _parse_name(user: Dict[str, Any], body: str) -> str:
+    name = body.strip()
+    if len(name) < 2: raise _Reject("Digite um nome válido (mín. 2 letras). Qual é o nome da criança?")
+    return name
+
+def _parse_age(user: Dict[str, Any], body: str) -> int:
+    m = _RE_INT2.match(body)
+    if not m: raise _Reject("Me diga um número (ex.: 9). Quantos anos ela tem?")
+    age = int(m.group(1))
+    if not (3 <= age <= 17): raise _Reject("Idade fora do padrão (3–17). Tente novamente.")
+    return age
+
+_GRADES_LOWER = [(g.lower(), g) for g in GRADES]
+
+def _parse_grade(user: Dict[str, Any], body: str) -> str:
+    n = _RE_INT2.match(body)
+    if n:
+        idx = int(n.group(1)) - 1
+        if 0 <= idx < len(GRADES): return GRADES[idx]
+        raise _Reject(_PROMPT_GRADE)
+    txt = body.strip().lower()
+    for low, g in _GRADES_LOWER:
+        if txt in low: return g
+    raise _Reject(_PROMPT_GRADE)
+
+def _parse_child_whatsapp(user: Dict[str, Any], body: str) -> Optional[str]:
+    b = body.strip().lower()
+    if _is_ok(b) or "não tem" in b or "nao tem" in b or b in ("nao","não","n"):
+        return None
+    d = _digits_only(body)
+    if not d: raise _Reject("Envie o WhatsApp da criança no formato +55 DDD XXXXX-XXXX ou responda *não tem*.")
+    return d
 
-    def _handle_time_for(day_key: str, day_pt: str, next_step: str) -> str:
+def _parse_guardians(user: Dict[str, Any], body: str) -> List[str]:
+    if _is_ok(body):
+        sender = (user.get("profile") or {}).get("guardians", [None])[0]
+        return [g for g in [sender] if g]
+    gs = _parse_phones_list(body)
+    sender = (user.get("profile") or {}).get("guardians", [])[0]
+    if sender and _digits_only(sender) not in [_digits_only(x) for x in gs]:
+        gs = [sender] + gs
+    return list(dict.fromkeys(gs))[:2]
+
+def _parse_sunday(user: Dict[str, Any], body: str) -> bool:
+    if _is_ok(body): return False
+    yn = _yes_no(body)
+    if yn is None: raise _Reject(_PROMPT_SUNDAY)
+    return yn
+
+def _save_sunday(user: Dict[str, Any], tmp: Dict[str, Any], yn: bool) -> None:
+    tmp.setdefault("schedule", _default_schedule())
+    tmp["schedule"]["sun"] = tmp["schedule"]["sun"] if yn else None
+
+def _time_parser(day_pt: str) -> Callable[[Dict[str, Any], str], str]:
+    retry = _wizard_prompt_time_for(day_pt)
+    def parse(user: Dict[str, Any], body: str) -> str:
         s = body.strip()
-        if _is_ok(s): t = _parse_hhmm_strict("19:00")
-        else:
-            choice = re.match(r"^\s*([1-5])\s*$", s)
-            if choice:
-                c = int(choice.group(1))
-                mapping = {1:"08:00", 2:"18:30", 3:"19:00", 4:"20:00"}
-                if c in (1,2,3,4): t = _parse_hhmm_strict(mapping[c])
-                else: return "Digite o horário desejado (ex.: 18:30, 19h, 7 pm)."
-            else:
-                t = _parse_hhmm_strict(s) or _parse_time_loose(s)
-                if not t: return _wizard_prompt_time_for(day_pt)
+        if _is_ok(s): return "19:00"
+        choice = _RE_CHOICE_1_5.match(s)
+        if choice:
+            c = int(choice.group(1))
+            if c in _TIME_CHOICES: return _TIME_CHOICES[c]
+            raise _Reject("Digite o horário desejado (ex.: 18:30, 19h, 7 pm).")
+        t = _parse_hhmm_strict(s) or _parse_time_loose(s)
+        if not t: raise _Reject(retry)
+        return f"{t.hour:02d}:{t.minute:02d}"
+    return parse
+
+def _time_saver(day_key: str) -> Callable[[Dict[str, Any], Dict[str, Any], Any], None]:
+    def save(user: Dict[str, Any], tmp: Dict[str, Any], hhmm: str) -> None:
         tmp.setdefault("schedule", _default_schedule())
-        tmp["schedule"][day_key] = f"{t.hour:02d}:{t.minute:02d}"
-        wz["step"] = next_step
-        if next_step == "ask_time_tue":  return _wizard_prompt_time_for("ter")
-        if next_step == "ask_time_wed":  return _wizard_prompt_time_for("qua")
-        if next_step == "ask_time_thu":  return _wizard_prompt_time_for("qui")
-        if next_step == "ask_time_fri":  return _wizard_prompt_time_for("sex")
-        if next_step == "ask_time_sat":  return _wizard_prompt_time_for("sáb")
-        return _wizard_confirm(user, tmp)
-
-    if step == "ask_time_mon": return _handle_time_for("mon","seg","ask_time_tue")
-    if step == "ask_time_tue": return _handle_time_for("tue","ter","ask_time_wed")
-    if step == "ask_time_wed": return _handle_time_for("wed","qua","ask_time_thu")
-    if step == "ask_time_thu": return _handle_time_for("thu","qui","ask_time_fri")
-    if step == "ask_time_fri": return _handle_time_for("fri","sex","ask_time_sat")
-    if step == "ask_time_sat": return _handle_time_for("sat","sáb","confirm")
-
-    if step == "confirm":
-        if _is_ok(body): yn = True
-        else:
-            yn = _yes_no(body)
-            if yn is None: return _wizard_confirm(user, tmp)
-        if not yn:
-            user["wizard"] = None
-            return _start_wizard(user)
-        prof = user.setdefault("profile", {})
-        prof["child_name"] = tmp.get("child_name")
-        prof["child_age"] = tmp.get("child_age")
-        prof["grade"] = tmp.get("grade")
-        prof["child_phone"] = tmp.get("child_phone")
-        if tmp.get("guardians"): prof["guardians"] = tmp["guardians"]
-        if tmp.get("schedule"):  user["schedule"] = tmp["schedule"]
+        tmp["schedule"][day_key] = hhmm
+    return save
+
+def _parse_confirm(user: Dict[str, Any], body: str) -> bool:
+    if _is_ok(body): return True
+    yn = _yes_no(body)
+    if yn is None: raise _Reject(_wizard_confirm(user, (user.get("wizard") or {}).get("tmp") or {}))
+    return yn
+
+def _save_confirm(user: Dict[str, Any], tmp: Dict[str, Any], yn: bool) -> str:
+    if not yn:
         user["wizard"] = None
-        return "Cadastro salvo!  Use *status* para ver a rotina do dia, ou escreva *começar aula* quando quiser iniciar."
+        return _start_wizard(user)
+    prof = user.setdefault("profile", {})
+    prof["child_name"] = tmp.get("child_name")
+    prof["child_age"] = tmp.get("child_age")
+    prof["grade"] = tmp.get("grade")
+    prof["child_phone"] = tmp.get("child_phone")
+    if tmp.get("guardians"): prof["guardians"] = tmp["guardians"]
+    if tmp.get("schedule"):  user["schedule"] = tmp["schedule"]
+    user["wizard"] = None
+    return "Cadastro salvo!  Use *status* para ver a rotina do dia, ou escreva *começar aula* quando quiser iniciar."
+
+def _build_wizard_steps() -> Dict[str, _WizardStep]:
+    steps = {
+        "ask_name": _WizardStep("Pra começar, me diga: *qual é o nome da criança?*",
+                                _parse_name, _set_tmp("child_name"), "ask_age"),
+        "ask_age": _WizardStep(lambda user, tmp: f"Perfeito, {tmp.get('child_name')}! \nQuantos anos ela tem?",
+                               _parse_age, _set_tmp("child_age"), "ask_grade"),
+        "ask_grade": _WizardStep(_PROMPT_GRADE, _parse_grade, _set_tmp("grade"), "ask_child_whatsapp"),
+        "ask_child_whatsapp": _WizardStep(_PROMPT_CHILD_WHATSAPP, _parse_child_whatsapp,
+                                          _set_tmp("child_phone"), "ask_guardians"),
+        "ask_guardians": _WizardStep(_PROMPT_GUARDIANS, _parse_guardians, _set_tmp("guardians"), "ask_sunday"),
+        "ask_sunday": _WizardStep(_PROMPT_SUNDAY, _parse_sunday, _save_sunday, "ask_time_mon"),
+    }
+    # um passo de horário por dia de seg a sáb, encadeados na ordem da semana
+    days = SCHEDULE_ORDER[:6]
+    for i, (day_key, day_pt) in enumerate(days):
+        nxt = f"ask_time_{days[i + 1][0]}" if i + 1 < len(days) else "confirm"
+        steps[f"ask_time_{day_key}"] = _WizardStep(_wizard_prompt_time_for(day_pt), _time_parser(day_pt),
+                                                   _time_saver(day_key), nxt)
+    steps["confirm"] = _WizardStep(_wizard_confirm, _parse_confirm, _save_confirm)
+    return steps
 
-    return None
+WIZARD_STEPS = _build_wizard_steps()
+
+def _handle_wizard(user: Dict[str, Any], body: str) -> Optional[str]:
+    wz = user.get("wizard")
+    if not wz: return None
+    step = WIZARD_STEPS.get(wz.get("step"))
+    if step is None: return None
+    tmp = wz.setdefault("tmp", {})
+    note_event("wizard_step", step=wz.get("step"))
+    try:
+        value = step.parse(user, body)
+    except _Reject as e:
+        return str(e)
+    done = step.save(user, tmp, value)
+    if done is not None or step.next is None: return done
+    wz["step"] = step.next
+    prompt = WIZARD_STEPS[step.next].prompt
+    return prompt(user, tmp) if callable(prompt) else prompt
 
 # ======================
 # Mensagens e Comandos
 # ======================
-WELCOME = (
-    "Olá! Eu sou a MARIA ANGELA \n"
-    "Posso acompanhar as atividades diárias de Matemática e Português"
-    f"{' e Leitura' if FEATURE_LEITURA else ''}.\n\n"
-    "Escolha uma opção:\n"
-    "a) iniciar   b) status   c) começar aula   d) #resetar\n"
-    "(ou digite os comandos normalmente)"
-)
+@lru_cache(maxsize=None)
+def _welcome(t: Tenant) -> str:
+    return (
+        f"Olá! Eu sou a {t.name} \n"
+        "Posso acompanhar as atividades diárias de Matemática e Português"
+        f"{' e Leitura' if t.feature_leitura else ''}.\n\n"
+        "Escolha uma opção:\n"
+        "a) iniciar   b) status   c) começar aula   d) #resetar   e) relatório\n"
+        "(ou digite os comandos normalmente)"
+    )
 
 def _status_text(user: Dict[str, Any]) -> str:
     now_dt = _now()
     day_key = _today_str(now_dt)
-    st = _get_day_state(user, day_key)
+    st = _peek_day_state(user, day_key)
     rem_dt = _get_today_reminder_dt(user, base_dt=now_dt)
     rem = rem_dt.strftime("%H:%M") if rem_dt else "—"
     dia_map = dict(SCHEDULE_ORDER)
@@ -636,128 +803,519 @@ def _status_text(user: Dict[str, Any]) -> str:
         f"- Notif. falta: {'sim' if st.get('miss_notified') else 'não'}"
     )
 
+# ======================
+# Relatório e resumo semanal (só leem user["rollup"])
+# ======================
+DIGEST_WEEKDAY = os.getenv("DIGEST_WEEKDAY", "sun").strip().lower()  # vazio = resumo semanal desligado
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "19"))
+# validado aqui: errado, quebraria cada rodada do agendador em vez de a partida
+if DIGEST_WEEKDAY and DIGEST_WEEKDAY not in rollups.WEEKDAYS:
+    raise ValueError(f"DIGEST_WEEKDAY inválido: {DIGEST_WEEKDAY!r} (use {'/'.join(rollups.WEEKDAYS)} ou vazio)")
+if not 0 <= DIGEST_HOUR <= 23: raise ValueError(f"DIGEST_HOUR fora de 0..23: {DIGEST_HOUR}")
+# ritmo de envio do resumo (token bucket), envios simultâneos e mensagens por checkpoint
+DIGEST_RATE_PER_S = float(os.getenv("DIGEST_RATE_PER_S", "5"))
+DIGEST_BURST = int(os.getenv("DIGEST_BURST", "10"))
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "4"))
+DIGEST_WINDOW = int(os.getenv("DIGEST_WINDOW", "20"))
+# O ritmo vale para o envio ao Twilio: com OUTBOX_ASYNC é o worker do outbox
+# que espera a vez (lane "digest"); o dispatcher só enfileira, sem ritmo.
+_digest_bucket = TokenBucket(DIGEST_RATE_PER_S, DIGEST_BURST)
+
+def _report_text(user: Dict[str, Any], day_key: str, weekly: bool = False) -> str:
+    name = (user.get("profile") or {}).get("child_name") or "A criança"
+    return rollups.report_text(name, rollups.summary(user, day_key), weekly=weekly)
+
+def _digest_recipients() -> List[Tuple[str, List[str]]]:
+    """("namespace|dígitos do responsável", chaves dos filhos), ordenado pelo
+    cursor. Só chaves ficam na memória; os registros são relidos no envio."""
+    by_guardian: Dict[str, List[str]] = {}
+    for key, user in iter_users():
+        if not user.get("rollup"): continue  # nunca fez aula nem fechou dia
+        ns = TENANTS.for_key(key).namespace
+        for g in (user.get("profile") or {}).get("guardians", []) or []:
+            d = _digits_only(g)
+            if d: by_guardian.setdefault(f"{ns}|{d}", []).append(key)
+    return sorted(by_guardian.items())
+
+def _digest_messages(run_id: str) -> Iterator[Message]:
+    """Uma mensagem por responsável (e tenant), com o resumo de cada filho."""
+    ref = rollups.digest_day(run_id)
+    for cursor, keys in _digest_recipients():
+        users = [u for u in (_load_user(k) for k in keys) if u and u.get("rollup")]
+        if not users: continue
+        body = "\n\n".join(_report_text(u, ref, weekly=True) for u in users)
+        yield cursor, cursor.partition("|")[2], body, TENANTS.for_key(keys[0]).twilio_from
+
+def _digest_send(to: str, body: str, from_: str) -> None:
+    _send_whatsapp(to, body, from_, lane="digest")
+    _metrics.inc("digest_messages_total")
+
+_digest = DigestDispatcher(
+    send=_digest_send,
+    load_checkpoint=lambda: get_meta("digest_run"),
+    save_checkpoint=lambda cp: put_meta("digest_run", cp),
+    acquire_lease=lambda owner, ttl: acquire_lease("digest", owner, ttl),
+    bucket=None if OUTBOX_ASYNC else _digest_bucket, rate_per_s=0,  # ritmo: ver _digest_bucket
+    concurrency=DIGEST_CONCURRENCY, window=DIGEST_WINDOW,
+)
+
+def _digest_run_id(now_dt: datetime) -> Tuple[str, bool]:
+    """Data do último disparo programado (DIGEST_WEEKDAY às DIGEST_HOUR) e se
+    ele foi há menos de um dia (rodada nova só começa nessa janela)."""
+    back = (now_dt.weekday() - rollups.WEEKDAYS.index(DIGEST_WEEKDAY)) % 7
+    if back == 0 and now_dt.hour < DIGEST_HOUR: back = 7
+    fresh = back == 0 or (back == 1 and now_dt.hour < DIGEST_HOUR)
+    return (now_dt.date() - timedelta(days=back)).isoformat(), fresh
+
+def _maybe_send_digest(now_dt: datetime) -> Optional[Dict[str, Any]]:
+    """Dispara (ou retoma, após restart) o resumo da semana em segundo plano.
+    Horário no fuso padrão."""
+    if not DIGEST_WEEKDAY: return None
+    run_id, fresh = _digest_run_id(now_dt)
+    cp = get_meta("digest_run") or {}
+    if cp.get("run") == run_id:
+        if cp.get("done"): return None
+    elif not fresh:
+        return None
+    started = _digest.start(run_id, lambda: _digest_messages(run_id))
+    return {"run": run_id, "started": started, "sent": cp.get("sent", 0) if cp.get("run") == run_id else 0}
+
 # ==================
 # Webhook / Endpoints
 # ==================
+# Reenvios do Twilio (mesmo MessageSid) recebem a resposta já dada.
+IDEMPOTENCY_TTL_S = float(os.getenv("IDEMPOTENCY_TTL_S", "600"))
+IDEMPOTENCY_MAX = int(os.getenv("IDEMPOTENCY_MAX", "10000"))
+_replies = ReplyCache(IDEMPOTENCY_MAX, IDEMPOTENCY_TTL_S)
+
+def _cached_reply(sid: str) -> Optional[Response]:
+    twiml = _replies.get(sid)
+    if twiml is None: return None
+    _metrics.inc("bot_duplicates_total")
+    return Response(twiml, mimetype="application/xml")
+
 @app.post("/bot")
 def bot() -> Response:
-    d = _db()
+    t0 = time.perf_counter()
+    sid = request.values.get("MessageSid", "")
+    dup = _cached_reply(sid)
+    if dup is not None: return dup
     from_raw = request.values.get("From", "")
     body = (request.values.get("Body", "") or "").strip()
-    lower = body.lower()
-
-    user_key, user = _get_or_create_user(d, from_raw)
-    init_user_if_needed(d, user_key)
-
-    resp = MessagingResponse()
-    msg = resp.message()
-
+    tenant = TENANTS.for_number(request.values.get("To", ""))
+    _metrics.inc("bot_messages_total", tenant=tenant.namespace or "default")
+    with _using_tenant(tenant):
+        with _metrics.timer("bot_phase_seconds", phase="resolve"):
+            user_key = _resolve_user_key(from_raw)
+        # Um ciclo ler-modificar-gravar por usuário de cada vez (waitress usa threads).
+        t1 = time.perf_counter()
+        with user_lock(user_key):
+            _metrics.observe("bot_phase_seconds", time.perf_counter() - t1, phase="lock_wait")
+            # o original pode ter terminado enquanto este reenvio esperava o lock
+            dup = _cached_reply(sid)
+            if dup is not None: return dup
+            with _metrics.timer("bot_phase_seconds", phase="handle"):
+                twiml = _bot_locked(user_key, from_raw, body)
+            _replies.put(sid, twiml)
+    _metrics.observe("bot_request_seconds", time.perf_counter() - t0)
+    return Response(twiml, mimetype="application/xml")
+
+def _fold(text: str) -> str:
+    """Normaliza comando: minúsculas, sem acentos e com espaços simples."""
+    t = unicodedata.normalize("NFKD", (text or "").strip().lower())
+    return " ".join("".join(c for c in t if not unicodedata.combining(c)).split())
+
+@dataclass
+class _Turn:
+    key: str
+    user: Dict[str, Any]
+    body: str
+    created: bool  # registro criado nesta mensagem (ainda não gravado)
+
+_Handler = Callable[[_Turn], str]
+
+# Tabelas de comandos (texto normalizado -> (ramo, handler)), montadas na
+# importação; sinônimo repetido entre comandos é erro de programação.
+_GLOBAL_COMMANDS: Dict[str, Tuple[str, _Handler]] = {}   # valem em qualquer contexto
+_LESSON_COMMANDS: Dict[str, Tuple[str, _Handler]] = {}   # depois do wizard
+_IDLE_CHOICES = {"a": "iniciar", "1": "iniciar", "b": "status", "2": "status",
+                 "c": "comecar aula", "3": "comecar aula", "d": "#resetar", "4": "#resetar",
+                 "e": "relatorio", "5": "relatorio"}
+
+def _command(table: Dict[str, Tuple[str, _Handler]], branch: str, *words: str) -> Callable[[_Handler], _Handler]:
+    def register(fn: _Handler) -> _Handler:
+        for w in words:
+            k = _fold(w)
+            if k in _GLOBAL_COMMANDS or k in _LESSON_COMMANDS: raise ValueError(f"comando duplicado: {w}")
+            table[k] = (branch, fn)
+        return fn
+    return register
+
+@_command(_GLOBAL_COMMANDS, "reset", "#resetar", "resetar", "#reset", "reset")
+def _cmd_reset(t: _Turn) -> str:
+    _delete_user(t.key)
+    return "Tudo zerado. Digite *iniciar* para começar do zero."
+
+@_command(_GLOBAL_COMMANDS, "restart_wizard", "reiniciar cadastro", "reset cadastro", "recomeçar cadastro")
+def _cmd_restart_wizard(t: _Turn) -> str:
+    t.user["wizard"] = None
+    out = _start_wizard(t.user)
+    _put_user(t.key, t.user)
+    return out
+
+@_command(_GLOBAL_COMMANDS, "start_wizard", "iniciar", "start")
+def _cmd_start_wizard(t: _Turn) -> str:
+    out = _start_wizard(t.user)
+    _put_user(t.key, t.user)
+    return out
+
+@_command(_GLOBAL_COMMANDS, "status", "status", "debug status", "s")
+def _cmd_status(t: _Turn) -> str:
+    if t.created: _put_user(t.key, t.user)
+    return _status_text(t.user)
+
+@_command(_GLOBAL_COMMANDS, "day_done", "fim", "finalizar", "concluir", "fechar dia")
+def _cmd_day_done(t: _Turn) -> str:
+    mark_day_done(t.user, when=_now())
+    _put_user(t.key, t.user)
+    return "Dia marcado como concluído. Aviso enviado aos responsáveis."
+
+@_command(_GLOBAL_COMMANDS, "cancel_lesson", "cancelar aula", "cancelar", "parar aula")
+def _cmd_cancel_lesson(t: _Turn) -> str:
+    if t.user.get("lesson") or t.created:
+        t.user["lesson"] = None
+        _put_user(t.key, t.user)
+    return "Aula cancelada. Quando quiser retomar, envie *começar aula*."
+
+@_command(_LESSON_COMMANDS, "report", "relatório", "resumo", "report")
+def _cmd_report(t: _Turn) -> str:
+    if t.created: _put_user(t.key, t.user)
+    return _report_text(t.user, _today_str())
+
+@_command(_LESSON_COMMANDS, "lesson_start", "começar aula", "iniciar aula", "aula", "começar")
+def _cmd_lesson_start(t: _Turn) -> str:
+    if t.user.get("lesson"):
+        return _present_current_question(t.user)  # só reapresenta
+    out = _start_lesson(t.user)
+    _put_user(t.key, t.user)
+    return out
+
+def _route(t: _Turn) -> Tuple[str, str]:
+    """Escolhe o ramo da mensagem: (nome do ramo, texto da resposta)."""
+    cmd = _fold(t.body)
     # Multi-escolha global (só quando NÃO estiver em wizard nem em aula)
-    if not user.get("wizard") and not user.get("lesson"):
-        if lower in ("a","1"): lower = "iniciar"
-        elif lower in ("b","2"): lower = "status"
-        elif lower in ("c","3"): lower = "começar aula"
-        elif lower in ("d","4"): lower = "#resetar"
-
-    # Comandos de atalho (admin/fluxo)
-    if lower in ("#resetar", "resetar", "#reset", "reset"):
-        d["users"].pop(user_key, None)
-        _save(d)
-        msg.body("Tudo zerado. Digite *iniciar* para começar do zero.")
-        return Response(str(resp), mimetype="application/xml")
-
-    if lower in ("reiniciar cadastro", "reset cadastro", "recomeçar cadastro", "recomecar cadastro"):
-        user["wizard"] = None
-        _save(d)
-        msg.body(_start_wizard(user))
-        return Response(str(resp), mimetype="application/xml")
-
-    if lower in ("iniciar", "start"):
-        msg.body(_start_wizard(user))
-        _save(d)
-        return Response(str(resp), mimetype="application/xml")
-
-    if lower in ("status", "debug status", "s"):
-        msg.body(_status_text(user))
-        _save(d)
-        return Response(str(resp), mimetype="application/xml")
-
-    if lower in ("fim", "finalizar", "concluir", "fechar dia"):
-        mark_day_done(user, when=_now())
-        _save(d)
-        msg.body("Dia marcado como concluído. Aviso enviado aos responsáveis.")
-        return Response(str(resp), mimetype="application/xml")
-
-    if lower in ("cancelar aula", "cancelar", "parar aula"):
-        user["lesson"] = None
-        _save(d)
-        msg.body("Aula cancelada. Quando quiser retomar, envie *começar aula*.")
-        return Response(str(resp), mimetype="application/xml")
+    if not t.user.get("wizard") and not t.user.get("lesson"):
+        cmd = _IDLE_CHOICES.get(cmd, cmd)
+
+    hit = _GLOBAL_COMMANDS.get(cmd)
+    if hit: return hit[0], hit[1](t)
 
     # Wizard de cadastro tem prioridade
-    if user.get("wizard"):
-        out = _handle_wizard(user, body)
+    if t.user.get("wizard"):
+        with _metrics.timer("bot_phase_seconds", phase="wizard"):
+            out = _handle_wizard(t.user, t.body)
         if out:
-            msg.body(out)
-            _save(d)
-            return Response(str(resp), mimetype="application/xml")
-
-    # Iniciar/continuar aula
-    if lower in ("começar aula", "comecar aula", "iniciar aula", "aula", "começar"):
-        if user.get("lesson"):
-            msg.body(_present_current_question(user))
-        else:
-            msg.body(_start_lesson(user))
-        _save(d)
-        return Response(str(resp), mimetype="application/xml")
+            _put_user(t.key, t.user)
+            if not t.user.get("wizard"):  # confirm gravou child_phone/guardians/schedule
+                _index_user(t.key, t.user)
+            return "wizard", out
+
+    hit = _LESSON_COMMANDS.get(cmd)
+    if hit: return hit[0], hit[1](t)
 
     # Resposta de aula em andamento (a..d / 1..4)
-    if user.get("lesson"):
-        msg.body(_apply_answer(user, body))
-        _save(d)
-        return Response(str(resp), mimetype="application/xml")
+    if t.user.get("lesson"):
+        out = _apply_answer(t.user, t.body)
+        _put_user(t.key, t.user)
+        return "lesson_answer", out
 
     # Default
-    msg.body(WELCOME)
-    _save(d)
-    return Response(str(resp), mimetype="application/xml")
+    if t.created: _put_user(t.key, t.user)
+    return "welcome", _welcome(_tenant())
+
+def _bot_locked(user_key: str, from_raw: str, body: str) -> str:
+    reset_events()
+    user = _load_user(user_key)
+    # Consultas (status, boas-vindas) não mexem no registro: só gravam se ele
+    # acabou de ser criado.
+    created = user is None
+    if created:
+        user = _new_user(from_raw)
+        _metrics.inc("bot_new_users_total")
+    init_user_if_needed({"users": {user_key: user}}, user_key)
+
+    t0 = time.perf_counter()
+    branch, text = _route(_Turn(user_key, user, body, created))
+    # registro novo entra nos índices só depois de gravado (#resetar não grava)
+    if created and _load_user(user_key) is not None: _index_user(user_key, user)
+    _metrics.observe("bot_command_seconds", time.perf_counter() - t0, branch=branch)
+    _metrics.inc("bot_commands_total", branch=branch)
+
+    resp = MessagingResponse()
+    resp.message().body(text)
+    return str(resp)
+
+CRON_CHUNK = int(os.getenv("CRON_CHUNK", "200"))
+CRON_PARALLELISM = int(os.getenv("CRON_PARALLELISM", "8"))
+
+def _run_checkins(keys: List[str], now_dt: datetime, dry: bool = False) -> List[Dict[str, Any]]:
+    """Check-in em duas fases: (1) planeja e grava as flags em lotes travados;
+    (2) dispara os envios em paralelo (no máx. CRON_PARALLELISM ao mesmo tempo)."""
+    results: Dict[str, Dict[str, Any]] = {}
+    sends: List[Tuple[str, str, str, str]] = []  # (user, to, body, from)
+    step = max(1, CRON_CHUNK)
+    _metrics.inc("cron_users_total", len(keys))
+    for i in range(0, len(keys), step):
+        chunk = keys[i:i + step]
+        # trava as chaves do lote e relê cada usuário: o que o webhook gravou
+        # entre uma leitura e outra não é sobrescrito
+        with user_lock(*chunk), _metrics.timer("cron_phase_seconds", phase="plan_apply"):
+            reset_events()
+            changed: Dict[str, Dict[str, Any]] = {}
+            for k in chunk:
+                user = _load_user(k)
+                if user is None:
+                    # sobra de índice sem registro: sai dos índices (delete sem registro só desindexa)
+                    if not dry: _delete_user(k)
+                    continue
+                tenant = TENANTS.for_key(k)
+                with _using_tenant(tenant):
+                    now_k = now_dt.astimezone(_tz()) if _tz() else now_dt  # relógio do tenant
+                    tag = _cron_plan(user, now_k)
+                    if dry:
+                        results[k] = {"user": k, "result": "SIM:" + tag}
+                        continue
+                    msgs = _cron_apply(user, now_k, tag)
+                results[k] = {"user": k, "result": tag, "sent": 0}
+                if msgs:
+                    note_event("notified", user=k, kind=tag.split(":")[-1], day=_today_str(now_k))
+                    changed[k] = user
+                    sends.extend((k, to, body, tenant.twilio_from) for to, body in msgs)
+            if changed:
+                with _metrics.timer("storage_seconds", op="put_users"):
+                    put_users(changed)
+
+    def _send(item: Tuple[str, str, str, str]) -> Tuple[str, Optional[str]]:
+        k, to, body, from_ = item
+        try:
+            _send_whatsapp(to, body, from_)
+            return k, None
+        except Exception as e:
+            return k, f"{type(e).__name__}: {e}"
+
+    if sends:
+        with ThreadPoolExecutor(max_workers=max(1, CRON_PARALLELISM)) as ex, \
+                _metrics.timer("cron_phase_seconds", phase="send"):
+            for k, err in ex.map(_send, sends):
+                if err:
+                    results[k].setdefault("errors", []).append(err)
+                    _metrics.inc("cron_messages_total", result="error")
+                else:
+                    results[k]["sent"] += 1
+                    _metrics.inc("cron_messages_total", result="sent")
+    return list(results.values())
+
+def _due_keys(now_dt: datetime) -> List[str]:
+    return due_checkins(_today_str(now_dt), _weekday_key(now_dt), now_dt.hour * 60 + now_dt.minute)
+
+def _tenant_zones() -> List[str]:
+    return sorted({t.tz for t in TENANTS.all()})
+
+def _run_due_checkins(now_dt: datetime, dry: bool = False) -> List[Dict[str, Any]]:
+    # o índice guarda horários locais: consulta uma vez por fuso dos tenants
+    results: List[Dict[str, Any]] = []
+    for tz in _tenant_zones():
+        now_tz = now_dt.astimezone(_zone(tz)) if ZoneInfo else now_dt
+        keys = [k for k in _due_keys(now_tz) if TENANTS.for_key(k).tz == tz]
+        res = _run_checkins(keys, now_dt, dry=dry)
+        if not dry:
+            # prazo vencido e já tratado: não há mais o que fazer por eles hoje
+            mark_checked(_today_str(now_tz), [r["user"] for r in res if r["result"] != "skip:not-due"])
+        results.extend(res)
+    return results
+
+# Retenção do daily_state (ver retention.py)
+DAILY_KEEP_DAYS = int(os.getenv("DAILY_KEEP_DAYS", "14"))
+DAILY_ARCHIVE_PATH = os.getenv("DAILY_ARCHIVE_PATH", "")
+
+def _run_compaction(today: str) -> Dict[str, Any]:
+    stats: Dict[str, Any] = {"day": today, "keep_days": DAILY_KEEP_DAYS, "users": 0, "days": 0,
+                             "records_bytes_before": 0, "records_bytes_after": 0,
+                             "db_bytes_before": db_size_bytes()}
+    keys = user_keys()
+    step = max(1, CRON_CHUNK)
+    for i in range(0, len(keys), step):
+        chunk = keys[i:i + step]
+        with user_lock(*chunk):
+            changed: Dict[str, Dict[str, Any]] = {}
+            for k in chunk:
+                user = _load_user(k)
+                if user is None: continue
+                before = len(json.dumps(user, ensure_ascii=False))
+                removed = compact_daily_state(user, today, DAILY_KEEP_DAYS)
+                if not removed: continue
+                archive_days(DAILY_ARCHIVE_PATH, k, removed)
+                changed[k] = user
+                stats["users"] += 1
+                stats["days"] += len(removed)
+                stats["records_bytes_before"] += before
+                stats["records_bytes_after"] += len(json.dumps(user, ensure_ascii=False))
+            if changed: put_users(changed)
+    stats["db_bytes_after"] = db_size_bytes()
+    put_meta("compacted_day", today)
+    return stats
+
+def _maybe_compact(now_dt: datetime, force: bool = False) -> Optional[Dict[str, Any]]:
+    """Compacta no máximo uma vez por dia (ou sempre, com force)."""
+    today = _today_str(now_dt)
+    if not force and get_meta("compacted_day") == today: return None
+    with _metrics.timer("cron_phase_seconds", phase="compact"):
+        return _run_compaction(today)
 
 @app.get("/admin/cron")
 def cron() -> Response:
-    d = _db()
     dry = request.args.get("dry", "0") in ("1", "true", "True")
+    # all=1 varre todos os usuários (sem o índice de prazos)
+    scan_all = request.args.get("all", "0") in ("1", "true", "True")
     now_dt = _now()
-
-    results: List[Tuple[str, str]] = []
-    for k, user in list((d.get("users") or {}).items()):
-        if dry:
-            tag = _cron_simulate(user, now_dt)
-            results.append((k, tag))
-        else:
-            tag = process_checkin_cron(user, now_dt)
-            results.append((k, tag or "skip"))
-
-    if not dry:
-        _save(d)
+    t0 = time.perf_counter()
+    if scan_all: results = _run_checkins(user_keys(), now_dt, dry=dry)
+    else: results = _run_due_checkins(now_dt, dry=dry)
+    force_compact = request.args.get("compact", "0") in ("1", "true", "True")
+    compaction = None if dry else _maybe_compact(now_dt, force=force_compact)
+    digest = None if dry else _maybe_send_digest(now_dt)
+    _metrics.inc("cron_runs_total", trigger="http", dry=str(dry).lower())
+    _metrics.observe("cron_request_seconds", time.perf_counter() - t0)
     return jsonify({
         "now": now_dt.isoformat(),
         "dry_run": dry,
-        "results": [{"user": k, "result": r} for k, r in results]
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+        "results": results,
+        "compaction": compaction,
+        "digest": digest,
     })
 
+@app.get("/admin/metrics")
+def metrics() -> Response:
+    if _outbox is not None:
+        for k, v in _outbox.stats().items(): _metrics.set("outbox_items", v, state=k)
+    if _scheduler is not None:
+        _metrics.set("scheduler_last_count", _scheduler.last_count)
+    _metrics.set("idempotency_cache_items", len(_replies))
+    store = get_store()
+    if isinstance(store, CachedStore):
+        for k, v in store.stats().items(): _metrics.set("user_cache", v, stat=k)
+    return Response(_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# ======================
+# Exportação / importação (NDJSON em streaming)
+# ======================
+def _admin_denied() -> Optional[Response]:
+    if not ADMIN_PASS: return Response("ADMIN_PASS não configurado\n", status=403, mimetype="text/plain")
+    auth = request.authorization
+    given = request.headers.get("X-Admin-Pass") or (auth.password if auth else None) or ""
+    if hmac.compare_digest(given.encode("utf-8"), ADMIN_PASS.encode("utf-8")): return None
+    return Response("senha inválida\n", status=401, mimetype="text/plain",
+                    headers={"WWW-Authenticate": 'Basic realm="admin"'})
+
+@app.get("/admin/export")
+def admin_export() -> Response:
+    """Usuários em NDJSON, um por linha, gerados sob demanda. Filtros:
+    grade=<série exata>, since/until=YYYY-MM-DD (última atividade), ns=<namespace>."""
+    denied = _admin_denied()
+    if denied is not None: return denied
+    a = request.args
+    filters = {"grade": a.get("grade", ""), "since": a.get("since", ""), "until": a.get("until", ""),
+               "namespace": a.get("ns")}
+    _metrics.inc("admin_export_total")
+    return Response(transfer.export_lines(iter_users(), **filters), mimetype="application/x-ndjson",
+                    headers={"Content-Disposition": "attachment; filename=users.ndjson"})
+
+@app.post("/admin/import")
+def admin_import() -> Response:
+    """Lê o corpo NDJSON (formato do export) linha a linha e grava em lotes de
+    IMPORT_BATCH, refazendo os índices. skip=1 não sobrescreve quem já existe;
+    dry=1 só valida."""
+    denied = _admin_denied()
+    if denied is not None: return denied
+    skip = request.args.get("skip", "0") in ("1", "true", "True")
+    dry = request.args.get("dry", "0") in ("1", "true", "True")
+    errors: List[Dict[str, Any]] = []
+    imported = skipped = 0
+    t0 = time.perf_counter()
+    for batch in transfer.batches(transfer.read_records(request.stream, errors), IMPORT_BATCH):
+        with user_lock(*batch):
+            if skip:
+                existing = [k for k in batch if _load_user(k) is not None]
+                for key in existing: del batch[key]
+                skipped += len(existing)
+            if not dry and batch:
+                with _metrics.timer("storage_seconds", op="put_users"):
+                    put_users(batch)
+                with _metrics.timer("storage_seconds", op="index_users"):
+                    index_users(batch)  # uma operação de índice por lote
+        imported += len(batch)  # em dry-run: quantos seriam gravados
+    if imported and not dry and _scheduler: _scheduler.poke()
+    _metrics.inc("admin_import_records_total", imported)
+    return jsonify({"imported": imported, "skipped": skipped, "dry_run": dry,
+                    "errors": errors[:100], "error_count": len(errors),
+                    "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)})
+
+@app.post("/admin/skill/recompute")
+def admin_skill_recompute() -> Response:
+    """Refaz as estimativas de habilidade a partir dos eventos "skill" do journal,
+    seguro com o servidor no ar (skill.backfill grava em lotes travados). Só no
+    backend journal: os outros não guardam os eventos."""
+    denied = _admin_denied()
+    if denied is not None: return denied
+    if STORAGE_BACKEND != "journal":
+        return Response("recompute só no STORAGE_BACKEND=journal\n", status=409, mimetype="text/plain")
+    t0 = time.perf_counter()
+    store = get_store()
+    flush = store.flush if isinstance(store, CachedStore) else (lambda: None)
+    n = skill.backfill(DB_PATH, _load_user, _put_user, lock=user_lock, flush=flush,
+                       base_level=lambda key: _grade_level(_load_user(key) or {}), batch=IMPORT_BATCH)
+    return jsonify({"recomputed": n, "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)})
+
 def _cron_simulate(user: Dict[str, Any], now_dt: datetime) -> str:
-    day_key = _today_str(now_dt)
-    st = _get_day_state(user, day_key)
-    rem_dt = _get_today_reminder_dt(user, base_dt=now_dt)
-    if rem_dt is None:
-        return "SIM:skip:no-schedule"
-    deadline = rem_dt + timedelta(hours=3)
-    if st["done"]:
-        return "SIM:sent:done" if not st.get("done_notified", False) else "SIM:skip:already-done-notified"
-    if now_dt >= deadline and not st.get("miss_notified", False):
-        return "SIM:sent:miss"
-    return "SIM:skip:not-due"
+    return "SIM:" + _cron_plan(user, now_dt)
 
 @app.get("/healthz")
 def healthz() -> Response:
-    return jsonify({"ok": True, "tz": PROJECT_TZ, "time": _now().isoformat()})
+    return jsonify({"ok": True, "tz": PROJECT_TZ, "time": _now().isoformat(), "tenants": len(TENANTS.all())})
+
+# ======================
+# Agendador interno (substitui o ping externo no /admin/cron)
+# ======================
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "True") == "True"
+SCHEDULER_MAX_SLEEP = float(os.getenv("SCHEDULER_MAX_SLEEP", "300"))
+
+def _next_deadline_dt(now_dt: datetime) -> Optional[datetime]:
+    found: List[datetime] = []
+    for tz in _tenant_zones():
+        now_tz = now_dt.astimezone(_zone(tz)) if ZoneInfo else now_dt
+        m = next_deadline(_weekday_key(now_tz), now_tz.hour * 60 + now_tz.minute)
+        if m is not None:
+            found.append(now_tz.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(minutes=m))
+    return min(found) if found else None
+
+def _scheduled_tick(now_dt: datetime) -> int:
+    _metrics.inc("cron_runs_total", trigger="scheduler", dry="false")
+    n = len(_run_due_checkins(now_dt))
+    _maybe_compact(now_dt)  # primeira rodada do dia também faz a retenção
+    _maybe_send_digest(now_dt)
+    return n
+
+_scheduler: Optional[CheckinScheduler] = None
+if SCHEDULER_ENABLED:
+    _scheduler = CheckinScheduler(
+        now=_now,
+        next_deadline=_next_deadline_dt,
+        run_due=_scheduled_tick,
+        acquire_lease=lambda owner, ttl: acquire_lease("checkin", owner, ttl),
+        max_sleep_s=SCHEDULER_MAX_SLEEP,
+    ).start()
+
+# Reentrega o que ficou pendente no outbox antes do último restart.
+if OUTBOX_ASYNC and _get_twilio_enabled() and (os.path.exists(OUTBOX_PATH) or os.path.exists(OUTBOX_PATH + ".log")):
+    _get_outbox()
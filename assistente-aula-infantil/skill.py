@@ -0,0 +1,132 @@
+# Dificuldade adaptativa: estimativa de habilidade (Elo) por usuário e por
+# operação, atualizada em O(1) a cada resposta. Cada nível do banco de questões
+# tem uma dificuldade fixa; a aula escolhe o nível cuja chance esperada de
+# acerto fica mais perto do alvo.
+
+import contextlib, sys
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import question_bank
+
+LEVEL_RATING = {1: 1000.0, 2: 1200.0, 3: 1400.0}
+TARGET_P = 0.75  # chance de acerto desejada
+K_NEW, K_SETTLED, SETTLE_AFTER = 48.0, 24.0, 20
+# pontuação pela tentativa em que acertou (1ª, 2ª, 3ª); errar as 3 = 0
+TRY_SCORE = (1.0, 0.6, 0.3)
+
+def grade_level(grade: Optional[str]) -> int:
+    """Nível de partida pela série: até 2º ano = 1, 3º/4º = 2, 5º = 3."""
+    g = grade or ""
+    if g.startswith(("3º", "4º")): return 2
+    if g.startswith("5º"): return 3
+    return 1
+
+def expected(rating: float, level: int) -> float:
+    return 1.0 / (1.0 + 10 ** ((LEVEL_RATING.get(level, LEVEL_RATING[1]) - rating) / 400.0))
+
+def score_for(tries: int, correct: bool) -> float:
+    """`tries` = erros antes desta resposta na mesma pergunta."""
+    if not correct: return 0.0
+    return TRY_SCORE[min(max(tries, 0), len(TRY_SCORE) - 1)]
+
+def _entry(user: Dict[str, Any], op: str, base_level: int) -> Dict[str, Any]:
+    sk = user.setdefault("skill", {})
+    e = sk.get(op)
+    if e is None:
+        # ponto de partida: o nível da série, um pouco acima do alvo de acerto
+        e = sk[op] = {"r": LEVEL_RATING.get(base_level, LEVEL_RATING[1]) + 190.0, "n": 0}
+    return e
+
+def rating(user: Dict[str, Any], op: str, base_level: int = 1) -> float:
+    e = (user.get("skill") or {}).get(op)
+    return float(e["r"]) if e else LEVEL_RATING.get(base_level, LEVEL_RATING[1]) + 190.0
+
+def update(user: Dict[str, Any], op: str, level: int, score: float, base_level: int = 1) -> float:
+    """Aplica um resultado (0..1) num item de `level`; devolve o novo rating."""
+    e = _entry(user, op, base_level)
+    r = float(e["r"])
+    k = K_NEW if int(e["n"]) < SETTLE_AFTER else K_SETTLED
+    e["r"] = round(r + k * (score - expected(r, level)), 1)
+    e["n"] = int(e["n"]) + 1
+    return e["r"]
+
+def pick_level(user: Dict[str, Any], op: str, base_level: int = 1) -> int:
+    """Nível com chance esperada mais próxima de TARGET_P (empate: o mais fácil)."""
+    r = rating(user, op, base_level)
+    return min(question_bank.LEVELS, key=lambda lv: (abs(expected(r, lv) - TARGET_P), lv))
+
+def recompute(results: Iterable[Tuple[str, str, int, float]],
+              base_level: Callable[[str], int] = lambda key: 1) -> Dict[str, Dict[str, Any]]:
+    """Refaz as estimativas do zero a partir de (usuário, op, nível, pontuação)
+    em ordem cronológica; devolve {usuário: {"skill": {...}}} para backfill."""
+    out: Dict[str, Dict[str, Any]] = {}
+    base: Dict[str, int] = {}
+    for key, op, level, score in results:
+        if key not in base: base[key] = base_level(key)
+        u = out.setdefault(key, {})
+        update(u, op, int(level), float(score), base[key])
+    return out
+
+def journal_results(db_path: str, since_seq: int = 0,
+                    last: Optional[Dict[str, int]] = None) -> Iterable[Tuple[str, str, int, float]]:
+    """Eventos "skill" da trilha do backend journal (só ele guarda os eventos;
+    nos outros backends não há de onde recalcular). `last["seq"]` recebe o
+    último seq lido."""
+    from storage import iter_journal
+    for rec in iter_journal(db_path, since_seq=since_seq):
+        if last is not None: last["seq"] = rec["seq"]
+        key = rec.get("key") or next(iter(rec.get("users") or {}), None)
+        for ev in rec.get("ev") or []:
+            if ev.get("type") == "skill" and (ev.get("user") or key):
+                yield ev.get("user") or key, ev["op"], int(ev["level"]), float(ev["score"])
+
+def backfill(db_path: str, load: Callable[[str], Optional[Dict[str, Any]]],
+             save: Callable[[str, Dict[str, Any]], None],
+             lock: Callable[..., Any] = lambda *keys: contextlib.nullcontext(),
+             flush: Callable[[], Any] = lambda: None,
+             base_level: Callable[[str], int] = lambda key: 1, batch: int = 200) -> int:
+    """Recalcula e grava as estimativas; devolve quantos usuários atualizou.
+
+    A trilha inteira é lida uma vez sem travar ninguém. Depois, lote a lote e
+    com o lote travado (`lock(*chaves)`), relê só o fim da trilha, aplica as
+    respostas que chegaram nesse meio tempo e grava: nenhuma se perde.
+    `flush()` empurra para o journal o que um cache write-behind ainda segura.
+    """
+    flush()
+    last = {"seq": 0}
+    fresh = recompute(journal_results(db_path, last=last), base_level)
+    keys = list(fresh)
+    n = 0
+    for i in range(0, len(keys), max(1, batch)):
+        chunk = keys[i:i + max(1, batch)]
+        with lock(*chunk):
+            flush()
+            mine = set(chunk)
+            for key, op, level, score in journal_results(db_path, since_seq=last["seq"]):
+                if key in mine: update(fresh[key], op, level, score, base_level(key))
+            for key in chunk:
+                cur = load(key)
+                if cur is None: continue
+                cur["skill"] = fresh[key]["skill"]
+                save(key, cur)
+                n += 1
+    return n
+
+if __name__ == "__main__":
+    # python skill.py recompute data/db.json   (só com o servidor parado)
+    # Só o backend journal: os eventos "skill" vêm da trilha dele. O journal
+    # fica travado enquanto o servidor está no ar; aí use POST /admin/skill/recompute.
+    if len(sys.argv) == 3 and sys.argv[1] == "recompute":
+        from storage import StoreBusyError, _make_store
+        try:
+            store = _make_store(sys.argv[2], "journal")
+        except StoreBusyError as e:
+            print(f"{e}; com o servidor no ar, use POST /admin/skill/recompute")
+            sys.exit(1)
+        grade_of = lambda key: grade_level(((store.get_user(key) or {}).get("profile") or {}).get("grade"))
+        n = backfill(sys.argv[2], store.get_user, store.put_user, base_level=grade_of)
+        store.close()
+        print(f"{n} usuário(s) recalculado(s)")
+    else:
+        print("uso: python skill.py recompute <db.json>   (servidor parado, backend journal)")
+        sys.exit(2)
@@ -1,14 +1,1251 @@
+import atexit, bisect, hashlib, json, os, re, shutil, sqlite3, sys, tempfile, threading, time, urllib.parse
+from datetime import date, timedelta
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-import json, os
 DB_PATH = os.getenv("DB_PATH", "data/db.json")
+# "json" | "sqlite" | "journal" | "sharded" (vazio = decide pela extensão do DB_PATH)
+# sharded: DB_PATH vira diretório (data/db.json -> data/db/users/ab/cd/<chave>.json, índices em arquivos ao lado)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "").strip().lower()
+JOURNAL_FSYNC_MS = int(os.getenv("JOURNAL_FSYNC_MS", "50"))
+JOURNAL_SNAPSHOT_EVERY = int(os.getenv("JOURNAL_SNAPSHOT_EVERY", "1000"))
+# Cache de usuários ativos na frente do backend (0 = desligado); ver CachedStore
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "0"))
+USER_CACHE_TTL_S = float(os.getenv("USER_CACHE_TTL_S", "300"))
+USER_CACHE_FLUSH_MS = int(os.getenv("USER_CACHE_FLUSH_MS", "200"))
+
+# Campos de primeiro nível do registro de usuário (viram colunas no SQLite).
+USER_FIELDS = ("profile", "schedule", "daily_state", "lesson", "wizard")
+SQLITE_EXTS = (".sqlite", ".sqlite3", ".db")
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+CHECKIN_GRACE_MIN = 180  # prazo do check-in = lembrete + 3h
+# cron_checked guarda alguns dias: tenants em fusos diferentes estão em dias
+# diferentes perto da meia-noite e não podem apagar o conjunto um do outro
+CHECKED_KEEP_DAYS = 2
+
+def _checked_cutoff(day_key: str) -> str:
+    return (date.fromisoformat(day_key) - timedelta(days=CHECKED_KEEP_DAYS)).isoformat()
+
+def _dumps(v: Any) -> str:
+    return json.dumps(v, ensure_ascii=False, separators=(",", ":"))
+
+def user_phones(user: Dict[str, Any], key: str = "") -> List[str]:
+    """Números (só dígitos) que identificam o usuário: criança + responsáveis.
+    Com chave de tenant ("ns:digitos"), os números levam o mesmo namespace."""
+    prof = user.get("profile") or {}
+    ns = key.rpartition(":")[0]
+    out: List[str] = []
+    for p in [prof.get("child_phone")] + list(prof.get("guardians") or []):
+        d = re.sub(r"\D+", "", p or "")
+        if d and ns: d = f"{ns}:{d}"
+        if d and d not in out: out.append(d)
+    return out
+
+def schedule_deadlines(user: Dict[str, Any]) -> Dict[str, int]:
+    """Prazo do check-in por dia da semana, em minutos desde 00:00 (pode passar de 1440)."""
+    out: Dict[str, int] = {}
+    for wd, hhmm in (user.get("schedule") or {}).items():
+        m = re.match(r"^\s*(\d{1,2}):(\d{2})\s*$", hhmm or "")
+        if wd in WEEKDAYS and m and int(m.group(1)) <= 23 and int(m.group(2)) <= 59:
+            out[wd] = int(m.group(1)) * 60 + int(m.group(2)) + CHECKIN_GRACE_MIN
+    return out
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = None) -> None:
+    """Grava em arquivo temporário no mesmo diretório e troca com os.replace():
+    um leitor concorrente vê o arquivo antigo ou o novo, nunca um truncado."""
+    d = os.path.dirname(path) or "."
+    os.makedirs(d, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=d)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try: os.unlink(tmp)
+        except OSError: pass
+        raise
+
+# ================================
+# Locks por usuário (load-modify-save)
+# ================================
+_user_locks: Dict[str, List[Any]] = {}  # key -> [Lock, refcount]
+_user_locks_guard = threading.Lock()
+
+@contextmanager
+def user_lock(*keys: str) -> Iterator[None]:
+    """Serializa o ciclo ler-modificar-gravar das chaves dadas (em ordem fixa,
+    então quem pega várias chaves — o cron — não entra em deadlock com o webhook)."""
+    ks = sorted({k for k in keys if k})
+    with _user_locks_guard:
+        ents = []
+        for k in ks:
+            ent = _user_locks.setdefault(k, [threading.Lock(), 0])
+            ent[1] += 1
+            ents.append(ent)
+    for ent in ents: ent[0].acquire()
+    try:
+        yield
+    finally:
+        for ent in reversed(ents): ent[0].release()
+        with _user_locks_guard:
+            for k, ent in zip(ks, ents):
+                ent[1] -= 1
+                if ent[1] == 0: _user_locks.pop(k, None)
+
+# ==========================
+# Backend JSON (arquivo único)
+# ==========================
+class JsonStore:
+    """Layout legado: um documento {"users": {...}} inteiro em um arquivo.
+
+    O documento parseado fica em cache enquanto o arquivo não muda (mtime/tamanho),
+    então get_user() só reparsa após escrita externa. Toda leitura/escrita do
+    documento passa por self._lock (waitress atende em várias threads).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._cache: Optional[Tuple[Tuple[int, int], Dict[str, Any]]] = None
+        self._lock = threading.RLock()
+
+    def _stamp(self) -> Tuple[int, int]:
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _doc(self) -> Dict[str, Any]:
+        """Documento em cache (não devolver para fora sem copiar)."""
+        if not os.path.exists(self.path):
+            self.save_all({"users": {}})
+        stamp = self._stamp()
+        if self._cache is None or self._cache[0] != stamp:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._cache = (stamp, json.load(f))
+        return self._cache[1]
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        atomic_write_json(self.path, data, indent=2)
+
+    def load_all(self) -> Dict[str, Any]:
+        with self._lock:
+            if not os.path.exists(self.path):
+                self.save_all({"users": {}})
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+    def save_all(self, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._write(data)
+            self._cache = None  # o chamador ainda pode mutar `data`
+
+    def get_user(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            user = (self._doc().get("users") or {}).get(key)
+            return json.loads(_dumps(user)) if user is not None else None
+
+    # Toda mutação vira uma operação {"op": ...}: _apply() altera o documento
+    # em memória e _commit() persiste (aqui regravando o arquivo inteiro; o
+    # JournalStore só acrescenta a operação ao journal).
+    def _mutate(self, op: Dict[str, Any]) -> None:
+        with self._lock:
+            doc = self._doc()
+            if self._apply(doc, op):
+                self._commit(doc, op)
+
+    def _commit(self, doc: Dict[str, Any], op: Dict[str, Any]) -> None:
+        self._write(doc)
+        self._cache = (self._stamp(), doc)
+
+    def _apply(self, doc: Dict[str, Any], op: Dict[str, Any]) -> bool:
+        kind = op["op"]
+        if kind == "put":
+            users = doc.setdefault("users", {})
+            for key, user in op["users"].items():
+                users[key] = json.loads(_dumps(user))
+        elif kind == "del":
+            # índices saem mesmo sem registro (nunca gravado ou já removido)
+            key, si = op["key"], self._sched(doc)
+            if ((doc.get("users") or {}).pop(key, None) is None and key not in si["by_user"]
+                    and key not in self._phones(doc).values()): return False
+            self._drop_phones(doc, key)
+            self._drop_schedule(si, key)
+        elif kind == "phones":
+            idx = self._phones(doc)
+            self._drop_phones(doc, op["key"])
+            for ph in op["phones"]: idx.setdefault(ph, op["key"])
+        elif kind == "sched":
+            si = self._sched(doc)
+            self._drop_schedule(si, op["key"])
+            self._add_schedule(si, op["key"], op["deadlines"])
+        elif kind == "reindex":  # lote: {key: [telefones, prazos]}, uma regravação só
+            idx, si = self._phones(doc), self._sched(doc)
+            self._drop_phones(doc, *op["items"])
+            for key, (phones, deadlines) in op["items"].items():
+                for ph in phones: idx.setdefault(ph, key)
+                self._drop_schedule(si, key)
+                self._add_schedule(si, key, deadlines)
+        elif kind == "meta":
+            doc.setdefault("meta", {})[op["name"]] = op["value"]
+        elif kind == "checked":
+            cc = self._checked(doc)
+            cc[op["day"]] = list(dict.fromkeys((cc.get(op["day"]) or []) + list(op["keys"])))
+            cutoff = _checked_cutoff(op["day"])
+            for day in [d for d in cc if d < cutoff]: del cc[day]
+        else:
+            raise ValueError(f"operação desconhecida: {kind}")
+        return True
+
+    def put_user(self, key: str, user: Dict[str, Any]) -> None:
+        self.put_users({key: user})
+
+    def put_users(self, items: Dict[str, Dict[str, Any]], events: Optional[List[Dict[str, Any]]] = None) -> None:
+        """Várias gravações em uma única troca de arquivo."""
+        if not items: return
+        op: Dict[str, Any] = {"op": "put", "users": items}
+        if events: op["ev"] = events
+        self._mutate(op)
+
+    def delete_user(self, key: str, events: Optional[List[Dict[str, Any]]] = None) -> None:
+        op: Dict[str, Any] = {"op": "del", "key": key}
+        if events: op["ev"] = events
+        self._mutate(op)
+
+    # Índice reverso dígitos -> chave, no próprio documento ("phones").
+    def _phones(self, doc: Dict[str, Any]) -> Dict[str, str]:
+        if "phones" not in doc:
+            idx: Dict[str, str] = {}
+            for k, u in (doc.get("users") or {}).items():
+                for ph in user_phones(u, k): idx.setdefault(ph, k)
+            doc["phones"] = idx
+        return doc["phones"]
+
+    @staticmethod
+    def _drop_phones(doc: Dict[str, Any], *keys: str) -> None:
+        idx = doc.get("phones") or {}
+        drop = set(keys)
+        for ph in [p for p, k in idx.items() if k in drop]: del idx[ph]
+
+    def find_user_by_phone(self, digits: str) -> Optional[str]:
+        with self._lock:
+            return self._phones(self._doc()).get(digits)
+
+    def index_phones(self, key: str, phones: List[str]) -> None:
+        self._mutate({"op": "phones", "key": key, "phones": list(phones)})
+
+    # Índice de prazos: "by_day" = {wd: [[min, key], ...] ordenado}, e
+    # "by_user" = {key: {wd: min}} para remover as entradas antigas.
+    def _sched(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        if "schedule_index" not in doc:
+            si: Dict[str, Any] = {"by_user": {}, "by_day": {}}
+            for k, u in (doc.get("users") or {}).items():
+                self._add_schedule(si, k, schedule_deadlines(u))
+            doc["schedule_index"] = si
+        return doc["schedule_index"]
+
+    @staticmethod
+    def _add_schedule(si: Dict[str, Any], key: str, deadlines: Dict[str, int]) -> None:
+        if not deadlines: return
+        si["by_user"][key] = dict(deadlines)
+        for wd, m in deadlines.items():
+            bisect.insort(si["by_day"].setdefault(wd, []), [m, key])
+
+    @staticmethod
+    def _drop_schedule(si: Dict[str, Any], key: str) -> None:
+        for wd, m in (si["by_user"].pop(key, None) or {}).items():
+            lst = si["by_day"].get(wd) or []
+            i = bisect.bisect_left(lst, [m, key])
+            if i < len(lst) and lst[i] == [m, key]: del lst[i]
+
+    def index_schedule(self, key: str, deadlines: Dict[str, int]) -> None:
+        self._mutate({"op": "sched", "key": key, "deadlines": dict(deadlines)})
+
+    def index_users(self, items: Dict[str, Dict[str, Any]]) -> None:
+        """index_phones + index_schedule de vários usuários numa operação."""
+        if not items: return
+        self._mutate({"op": "reindex", "items": {k: [user_phones(u, k), schedule_deadlines(u)] for k, u in items.items()}})
+
+    def due_checkins(self, day_key: str, weekday: str, upto_min: int) -> List[str]:
+        with self._lock:
+            doc = self._doc()
+            lst = self._sched(doc)["by_day"].get(weekday) or []
+            j = bisect.bisect_right(lst, [upto_min, "\U0010ffff"])
+            done = set(self._checked(doc).get(day_key) or [])
+            return [k for _, k in lst[:j] if k not in done]
+
+    def next_deadline(self, weekday: str, after_min: int) -> Optional[int]:
+        with self._lock:
+            lst = self._sched(self._doc())["by_day"].get(weekday) or []
+            j = bisect.bisect_right(lst, [after_min, "\U0010ffff"])
+            return lst[j][0] if j < len(lst) else None
+
+    def get_meta(self, name: str) -> Any:
+        with self._lock:
+            return (self._doc().get("meta") or {}).get(name)
+
+    def put_meta(self, name: str, value: Any) -> None:
+        self._mutate({"op": "meta", "name": name, "value": value})
+
+    @staticmethod
+    def _checked(doc: Dict[str, Any]) -> Dict[str, List[str]]:
+        """cron_checked por dia: {"YYYY-MM-DD": [chaves]} (aceita o formato antigo de um dia só)."""
+        cc = doc.get("cron_checked")
+        if not isinstance(cc, dict): cc = {}
+        elif "keys" in cc: cc = {cc.get("day") or "": list(cc.get("keys") or [])}
+        doc["cron_checked"] = cc
+        return cc
+
+    def mark_checked(self, day_key: str, keys: List[str]) -> None:
+        if keys: self._mutate({"op": "checked", "day": day_key, "keys": list(keys)})
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    # Lease entre processos: arquivo ao lado do db, com um .lock criado via
+    # O_EXCL protegendo o ler-decidir-gravar (funciona também no Windows).
+    def acquire_lease(self, name: str, owner: str, ttl_s: float) -> bool:
+        path = f"{self.path}.{name}.lease"
+        guard = path + ".lock"
+        try:
+            fd = os.open(guard, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:  # guarda órfã de um processo que morreu no meio
+                if time.time() - os.path.getmtime(guard) > 10: os.unlink(guard)
+            except OSError:
+                pass
+            return False
+        try:
+            os.close(fd)
+            now = time.time()
+            cur: Dict[str, Any] = {}
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    cur = json.load(f)
+            if cur.get("owner") not in (None, owner) and float(cur.get("until", 0)) > now:
+                return False
+            atomic_write_json(path, {"owner": owner, "until": now + ttl_s})
+            return True
+        finally:
+            try: os.unlink(guard)
+            except OSError: pass
+
+    def user_keys(self) -> List[str]:
+        with self._lock:
+            return list((self._doc().get("users") or {}).keys())
+
+    def iter_users(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for key in self.user_keys():
+            user = self.get_user(key)
+            if user is not None: yield key, user
+
+    def count_users(self) -> int:
+        with self._lock:
+            return len(self._doc().get("users") or {})
+
+# ==================================
+# Backend SQLite (WAL, 1 linha/usuário)
+# ==================================
+class SqliteStore:
+    """Uma linha por chave de usuário; cada campo do registro em uma coluna JSON.
+
+    Chaves fora de USER_FIELDS (ex.: levels/history do progress.py) vão para a
+    coluna `extra`, então o registro volta íntegro em get_user().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        d = os.path.dirname(path)
+        if d: os.makedirs(d, exist_ok=True)
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self) -> None:
+        cols = ", ".join(f"{c} TEXT" for c in USER_FIELDS)
+        conn = self._conn()
+        conn.execute(f"CREATE TABLE IF NOT EXISTS users (key TEXT PRIMARY KEY, {cols}, extra TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS phones (digits TEXT PRIMARY KEY, user_key TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS phones_user ON phones (user_key)")
+        conn.execute("CREATE TABLE IF NOT EXISTS schedule (user_key TEXT NOT NULL, weekday TEXT NOT NULL,"
+                     " deadline_min INTEGER NOT NULL, PRIMARY KEY (user_key, weekday))")
+        conn.execute("CREATE INDEX IF NOT EXISTS schedule_due ON schedule (weekday, deadline_min)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cron_checked (day TEXT NOT NULL, user_key TEXT NOT NULL,"
+                     " PRIMARY KEY (day, user_key))")
+        conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, until REAL NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        if conn.execute("SELECT 1 FROM phones LIMIT 1").fetchone() is None:
+            self.rebuild_phone_index()
+        if conn.execute("SELECT 1 FROM schedule LIMIT 1").fetchone() is None:
+            self.rebuild_schedule_index()
+
+    @staticmethod
+    def _to_row(key: str, user: Dict[str, Any]) -> Tuple[Any, ...]:
+        extra = {k: v for k, v in user.items() if k not in USER_FIELDS}
+        return (key, *[_dumps(user.get(c)) for c in USER_FIELDS], _dumps(extra))
+
+    @staticmethod
+    def _from_row(row: Tuple[Any, ...]) -> Dict[str, Any]:
+        user: Dict[str, Any] = {c: json.loads(v) if v else None for c, v in zip(USER_FIELDS, row[1:])}
+        user.update(json.loads(row[-1] or "{}"))
+        return user
+
+    def get_user(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM users WHERE key = ?", (key,)).fetchone()
+        return self._from_row(row) if row else None
+
+    def put_user(self, key: str, user: Dict[str, Any]) -> None:
+        marks = ", ".join("?" * (len(USER_FIELDS) + 2))
+        self._conn().execute(f"INSERT OR REPLACE INTO users VALUES ({marks})", self._to_row(key, user))
+
+    def put_users(self, items: Dict[str, Dict[str, Any]], events: Optional[List[Dict[str, Any]]] = None) -> None:
+        # eventos só são guardados no modo journal
+        if not items: return
+        marks = ", ".join("?" * (len(USER_FIELDS) + 2))
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(f"INSERT OR REPLACE INTO users VALUES ({marks})",
+                             [self._to_row(k, u) for k, u in items.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_user(self, key: str, events: Optional[List[Dict[str, Any]]] = None) -> None:
+        # numa transação só: um crash no meio não deixa índice apontando para ninguém
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM users WHERE key = ?", (key,))
+            conn.execute("DELETE FROM phones WHERE user_key = ?", (key,))
+            conn.execute("DELETE FROM schedule WHERE user_key = ?", (key,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def find_user_by_phone(self, digits: str) -> Optional[str]:
+        row = self._conn().execute("SELECT user_key FROM phones WHERE digits = ?", (digits,)).fetchone()
+        return row[0] if row else None
+
+    def index_phones(self, key: str, phones: List[str]) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM phones WHERE user_key = ?", (key,))
+            conn.executemany("INSERT OR IGNORE INTO phones VALUES (?, ?)", [(ph, key) for ph in phones])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def rebuild_phone_index(self) -> None:
+        rows = [(ph, k) for k, u in self.iter_users() for ph in user_phones(u, k)]
+        conn = self._conn()
+        conn.execute("DELETE FROM phones")
+        conn.executemany("INSERT OR IGNORE INTO phones VALUES (?, ?)", rows)
+
+    def index_schedule(self, key: str, deadlines: Dict[str, int]) -> None:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM schedule WHERE user_key = ?", (key,))
+            conn.executemany("INSERT INTO schedule VALUES (?, ?, ?)", [(key, wd, m) for wd, m in deadlines.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def index_users(self, items: Dict[str, Dict[str, Any]]) -> None:
+        if not items: return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            keys = [(k,) for k in items]
+            conn.executemany("DELETE FROM phones WHERE user_key = ?", keys)
+            conn.executemany("DELETE FROM schedule WHERE user_key = ?", keys)
+            conn.executemany("INSERT OR IGNORE INTO phones VALUES (?, ?)",
+                             [(ph, k) for k, u in items.items() for ph in user_phones(u, k)])
+            conn.executemany("INSERT INTO schedule VALUES (?, ?, ?)",
+                             [(k, wd, m) for k, u in items.items() for wd, m in schedule_deadlines(u).items()])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def rebuild_schedule_index(self) -> None:
+        rows = [(k, wd, m) for k, u in self.iter_users() for wd, m in schedule_deadlines(u).items()]
+        conn = self._conn()
+        conn.execute("DELETE FROM schedule")
+        conn.executemany("INSERT INTO schedule VALUES (?, ?, ?)", rows)
+
+    def due_checkins(self, day_key: str, weekday: str, upto_min: int) -> List[str]:
+        rows = self._conn().execute(
+            "SELECT s.user_key FROM schedule s LEFT JOIN cron_checked c ON c.day = ? AND c.user_key = s.user_key"
+            " WHERE s.weekday = ? AND s.deadline_min <= ? AND c.user_key IS NULL ORDER BY s.deadline_min",
+            (day_key, weekday, upto_min))
+        return [r[0] for r in rows]
+
+    def next_deadline(self, weekday: str, after_min: int) -> Optional[int]:
+        row = self._conn().execute("SELECT MIN(deadline_min) FROM schedule WHERE weekday = ? AND deadline_min > ?",
+                                   (weekday, after_min)).fetchone()
+        return row[0] if row and row[0] is not None else None
+
+    def get_meta(self, name: str) -> Any:
+        row = self._conn().execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_meta(self, name: str, value: Any) -> None:
+        self._conn().execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, _dumps(value)))
+
+    def size_bytes(self) -> int:
+        """Bytes em uso (páginas ocupadas), que caem após compactação mesmo sem VACUUM."""
+        conn = self._conn()
+        pages = conn.execute("PRAGMA page_count").fetchone()[0] - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return int(pages * conn.execute("PRAGMA page_size").fetchone()[0])
+
+    def acquire_lease(self, name: str, owner: str, ttl_s: float) -> bool:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, until FROM leases WHERE name = ?", (name,)).fetchone()
+            ok = row is None or row[0] == owner or row[1] <= now
+            if ok: conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (name, owner, now + ttl_s))
+            conn.execute("COMMIT")
+            return ok
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def mark_checked(self, day_key: str, keys: List[str]) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM cron_checked WHERE day < ?", (_checked_cutoff(day_key),))
+        conn.executemany("INSERT OR IGNORE INTO cron_checked VALUES (?, ?)", [(day_key, k) for k in keys])
+
+    def user_keys(self) -> List[str]:
+        return [r[0] for r in self._conn().execute("SELECT key FROM users ORDER BY key")]
+
+    def iter_users(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for row in self._conn().execute("SELECT * FROM users ORDER BY key"):
+            yield row[0], self._from_row(row)
+
+    def count_users(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM users").fetchone()[0])
+
+    # Compatibilidade com load_db()/save_db(): o snapshot da última leitura
+    # fica por thread, e o save só regrava as linhas que mudaram.
+    def load_all(self) -> Dict[str, Any]:
+        users: Dict[str, Any] = {}
+        snap: Dict[str, Tuple[Any, ...]] = {}
+        for row in self._conn().execute("SELECT * FROM users"):
+            users[row[0]] = self._from_row(row)
+            snap[row[0]] = tuple(row)
+        self._local.snapshot = snap
+        return {"users": users}
+
+    def save_all(self, data: Dict[str, Any]) -> None:
+        snap: Dict[str, Tuple[Any, ...]] = getattr(self._local, "snapshot", None) or {}
+        users = data.get("users") or {}
+        conn = self._conn()
+        marks = ", ".join("?" * (len(USER_FIELDS) + 2))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, user in users.items():
+                row = self._to_row(key, user)
+                if snap.get(key) != row:
+                    conn.execute(f"INSERT OR REPLACE INTO users VALUES ({marks})", row)
+            for key in set(snap) - set(users):
+                conn.execute("DELETE FROM users WHERE key = ?", (key,))
+                conn.execute("DELETE FROM phones WHERE user_key = ?", (key,))
+                conn.execute("DELETE FROM schedule WHERE user_key = ?", (key,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._local.snapshot = {k: self._to_row(k, u) for k, u in users.items()}
+
+# ===========================================
+# Backend journal (event-sourced, JSONL + snapshot)
+# ===========================================
+class StoreBusyError(RuntimeError):
+    """O arquivo já está aberto por outro processo (backends de processo único)."""
+
+def _lock_exclusive(path: str) -> Any:
+    """Trava exclusiva e não bloqueante em `path`; solta ao fechar o arquivo devolvido."""
+    f = open(path, "a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        raise StoreBusyError(f"{path} está travado: o journal já está aberto por outro processo")
+    return f
+
+class JournalStore(JsonStore):
+    """Estado em memória; cada mutação é uma linha JSONL acrescentada ao journal.
+
+    - `path` guarda o snapshot (mesmo formato do db.json) com meta.journal_seq;
+      na partida, snapshot + replay das linhas com seq maior reconstroem o estado.
+    - fsync em lote a cada `fsync_ms` (0 = fsync a cada escrita). Um crash do
+      processo não perde nada já escrito; queda de energia perde no máx. fsync_ms.
+    - a cada `snapshot_every` operações grava um snapshot novo e o journal vira
+      um segmento arquivado (`<path>.journal.<seq>`): é a trilha de auditoria.
+    - um único processo por arquivo (o estado vive na memória do processo):
+      `<path>.lock` fica travado enquanto o store existir, e abrir um segundo
+      levanta StoreBusyError.
+    """
+
+    def __init__(self, path: str, fsync_ms: int = 50, snapshot_every: int = 1000):
+        super().__init__(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._flock = _lock_exclusive(path + ".lock")
+        self.journal_path = path + ".journal"
+        self.fsync_ms = fsync_ms
+        self.snapshot_every = max(1, snapshot_every)
+        self._seq = 0
+        self._since_snap = 0
+        self._unsynced = False
+        self._mem = self._recover()
+        self._jf = open(self.journal_path, "a", encoding="utf-8")
+        if fsync_ms > 0:
+            threading.Thread(target=self._flusher, name="journal-fsync", daemon=True).start()
+
+    def _recover(self) -> Dict[str, Any]:
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+        else:
+            doc = {"users": {}}
+        self._seq = base = int((doc.get("meta") or {}).get("journal_seq", 0))
+        if os.path.exists(self.journal_path):
+            good = 0
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        break  # linha cortada por crash no meio da escrita
+                    good += len(line)
+                    if rec["seq"] > base:
+                        self._apply(doc, rec)
+                        self._seq = rec["seq"]
+                        self._since_snap += 1
+            if good < os.path.getsize(self.journal_path):
+                with open(self.journal_path, "r+b") as f: f.truncate(good)
+        return doc
+
+    def _doc(self) -> Dict[str, Any]:
+        return self._mem
+
+    def _commit(self, doc: Dict[str, Any], op: Dict[str, Any]) -> None:
+        self._seq += 1
+        self._jf.write(_dumps({"seq": self._seq, "ts": round(time.time(), 3), **op}) + "\n")
+        self._jf.flush()
+        if self.fsync_ms <= 0: os.fsync(self._jf.fileno())
+        else: self._unsynced = True
+        self._since_snap += 1
+        if self._since_snap >= self.snapshot_every: self.snapshot()
+
+    def _flusher(self) -> None:
+        while True:
+            time.sleep(self.fsync_ms / 1000.0)
+            with self._lock:
+                if self._unsynced and not self._jf.closed:
+                    os.fsync(self._jf.fileno())
+                    self._unsynced = False
+
+    def snapshot(self) -> None:
+        with self._lock:
+            self._mem.setdefault("meta", {})["journal_seq"] = self._seq
+            atomic_write_json(self.path, self._mem)
+            self._jf.flush()
+            os.fsync(self._jf.fileno())
+            self._jf.close()
+            if os.path.getsize(self.journal_path) > 0:
+                os.replace(self.journal_path, f"{self.journal_path}.{self._seq:012d}")
+            self._jf = open(self.journal_path, "a", encoding="utf-8")
+            self._unsynced = False
+            self._since_snap = 0
+
+    def close(self) -> None:
+        self.snapshot()
+        with self._lock:
+            self._jf.close()
+            self._flock.close()
+
+    def load_all(self) -> Dict[str, Any]:
+        with self._lock:
+            return json.loads(_dumps({"users": self._mem.get("users") or {}}))
+
+    def save_all(self, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._mem = json.loads(_dumps(data))
+            self._mem.pop("phones", None)
+            self._mem.pop("schedule_index", None)
+            self.snapshot()
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(p) for p in (self.path, self.journal_path) if os.path.exists(p))
+
+# ==============================================
+# Backend JSON fatiado (um arquivo por usuário)
+# ==============================================
+class ShardedJsonStore(JsonStore):
+    """Tudo em arquivos pequenos sob `<raiz>`, para nenhuma gravação custar O(N):
+
+    - users/ab/cd/<chave>.json: o registro (ab/cd = sha1 da chave), troca atômica
+    - phones/ab/cd/<dígitos>.json: dono do telefone (o primeiro a indexar fica)
+    - schedule/<wd>/<mmmm>/<chave>: marcador vazio por prazo (minuto do dia)
+    - index/ab/cd/<chave>.json: telefones e prazos atuais da chave, para desfazer
+    - checked/<dia>/<chave>: cron_checked, uns poucos dias
+    - meta.json: meta, com a mecânica do JsonStore
+
+    Indexar ou desindexar um usuário mexe só nos arquivos dele. due_checkins e
+    next_deadline listam os minutos do dia da semana; só user_keys()/load_all()
+    (retenção, migração, export) varrem os usuários.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.users_dir = os.path.join(root, "users")
+        super().__init__(os.path.join(root, "meta.json"))
+        legacy = os.path.join(root, "index.json")
+        if os.path.exists(legacy) and not os.path.exists(self.path): self._migrate_index_json(legacy)
+
+    @staticmethod
+    def _q(name: str) -> str:
+        return urllib.parse.quote(name, safe="")
+
+    def _hashed(self, sub: str, name: str, ext: str = ".json") -> str:
+        h = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, sub, h[:2], h[2:4], self._q(name) + ext)
+
+    def _user_path(self, key: str) -> str:
+        return self._hashed("users", key)
+
+    def _doc(self) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            with self._lock:
+                if not os.path.exists(self.path): self._write({})
+        return super()._doc()
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        atomic_write_json(self.path, data)
+
+    @staticmethod
+    def _read(path: str) -> Any:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "a").close()
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.unlink(path)
+            os.rmdir(os.path.dirname(path))  # minuto/dia vazio some da listagem
+        except OSError:
+            pass
+
+    @staticmethod
+    def _listdir(path: str) -> List[str]:
+        try:
+            return os.listdir(path)
+        except FileNotFoundError:
+            return []
+
+    # ---------- usuários ----------
+    def get_user(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._read(self._user_path(key))
+
+    def put_users(self, items: Dict[str, Dict[str, Any]], events: Optional[List[Dict[str, Any]]] = None) -> None:
+        for key, user in items.items():
+            atomic_write_json(self._user_path(key), user)
+
+    def delete_user(self, key: str, events: Optional[List[Dict[str, Any]]] = None) -> None:
+        try:
+            os.unlink(self._user_path(key))
+        except FileNotFoundError:
+            pass
+        with self._lock:  # desindexa mesmo sem registro
+            self._reindex(key, [], {})
+
+    def _user_files(self) -> Iterator[Tuple[str, str]]:
+        for d, _, files in os.walk(self.users_dir):
+            for fname in files:
+                if fname.endswith(".json") and not fname.startswith(".tmp-"):
+                    yield urllib.parse.unquote(fname[:-5]), os.path.join(d, fname)
+
+    def user_keys(self) -> List[str]:
+        return [k for k, _ in self._user_files()]
+
+    def count_users(self) -> int:
+        return sum(1 for _ in self._user_files())
+
+    # ---------- índices (só os arquivos da chave) ----------
+    def _sched_path(self, wd: str, m: int, key: str) -> str:
+        return os.path.join(self.root, "schedule", wd, f"{int(m):04d}", self._q(key))
+
+    def _reindex(self, key: str, phones: Optional[List[str]], deadlines: Optional[Dict[str, int]]) -> None:
+        """None = mantém aquela parte. Chamar com self._lock."""
+        ent_path = self._hashed("index", key)
+        ent = self._read(ent_path) or {"phones": [], "deadlines": {}}
+        before = json.loads(_dumps(ent))
+        if phones is not None:
+            for ph in ent["phones"]:
+                if ph not in phones and self._read(self._hashed("phones", ph)) == key:
+                    self._remove(self._hashed("phones", ph))
+            owned = []
+            for ph in dict.fromkeys(phones):
+                owner = self._read(self._hashed("phones", ph))
+                if owner is None: atomic_write_json(self._hashed("phones", ph), key)
+                if owner in (None, key): owned.append(ph)
+            ent["phones"] = owned
+        if deadlines is not None:
+            old = ent["deadlines"]
+            for wd, m in old.items():
+                if deadlines.get(wd) != m: self._remove(self._sched_path(wd, m, key))
+            for wd, m in deadlines.items():
+                if old.get(wd) != m: self._touch(self._sched_path(wd, m, key))
+            ent["deadlines"] = dict(deadlines)
+        if ent == before: return
+        if ent["phones"] or ent["deadlines"]: atomic_write_json(ent_path, ent)
+        else: self._remove(ent_path)
+
+    def find_user_by_phone(self, digits: str) -> Optional[str]:
+        return self._read(self._hashed("phones", digits))
+
+    def index_phones(self, key: str, phones: List[str]) -> None:
+        with self._lock: self._reindex(key, list(phones), None)
+
+    def index_schedule(self, key: str, deadlines: Dict[str, int]) -> None:
+        with self._lock: self._reindex(key, None, dict(deadlines))
+
+    def index_users(self, items: Dict[str, Dict[str, Any]]) -> None:
+        with self._lock:
+            for k, u in items.items(): self._reindex(k, user_phones(u, k), schedule_deadlines(u))
+
+    def _minutes(self, weekday: str) -> List[int]:
+        return sorted(int(m) for m in self._listdir(os.path.join(self.root, "schedule", weekday)) if m.isdigit())
+
+    def due_checkins(self, day_key: str, weekday: str, upto_min: int) -> List[str]:
+        done = {urllib.parse.unquote(f) for f in self._listdir(os.path.join(self.root, "checked", day_key))}
+        out: List[str] = []
+        for m in self._minutes(weekday):
+            if m > upto_min: break
+            keys = sorted(urllib.parse.unquote(f) for f in self._listdir(os.path.join(self.root, "schedule", weekday, f"{m:04d}")))
+            out.extend(k for k in keys if k not in done)
+        return out
+
+    def next_deadline(self, weekday: str, after_min: int) -> Optional[int]:
+        for m in self._minutes(weekday):
+            if m > after_min and self._listdir(os.path.join(self.root, "schedule", weekday, f"{m:04d}")): return m
+        return None
+
+    def mark_checked(self, day_key: str, keys: List[str]) -> None:
+        if not keys: return
+        base = os.path.join(self.root, "checked")
+        for k in keys: self._touch(os.path.join(base, day_key, self._q(k)))
+        cutoff = _checked_cutoff(day_key)
+        for day in self._listdir(base):
+            if day < cutoff: shutil.rmtree(os.path.join(base, day), ignore_errors=True)
+
+    # ---------- base inteira ----------
+    def load_all(self) -> Dict[str, Any]:
+        with self._lock:
+            doc = json.loads(_dumps(self._doc()))
+        doc["users"] = dict(self.iter_users())
+        return doc
+
+    def save_all(self, data: Dict[str, Any]) -> None:
+        """Substitui a base inteira (migração/restauração) e refaz os índices."""
+        users = data.get("users") or {}
+        with self._lock:
+            for sub in ("index", "phones", "schedule", "checked"):
+                shutil.rmtree(os.path.join(self.root, sub), ignore_errors=True)
+            for key, path in list(self._user_files()):
+                if key not in users: os.unlink(path)
+            self.put_users(users)
+            self.index_users(users)
+            for day, keys in self._checked(dict(data)).items():
+                if day: self.mark_checked(day, keys)
+            super().save_all({"meta": data.get("meta") or {}})
+
+    def _migrate_index_json(self, legacy: str) -> None:
+        """Layout anterior (índices num index.json só): refaz em arquivos."""
+        with open(legacy, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        with self._lock:
+            self.index_users(dict(self.iter_users()))
+            for day, keys in self._checked(old).items():
+                if day: self.mark_checked(day, keys)
+            self._write({"meta": old.get("meta") or {}})
+            os.replace(legacy, legacy + ".old")
+
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(self.root) for f in files)
+
+def iter_journal(path: str, user_key: Optional[str] = None, since_seq: int = 0) -> Iterator[Dict[str, Any]]:
+    """Relê a trilha completa (segmentos arquivados + journal atual), em ordem.
+    `since_seq` pula o que já foi lido: cada segmento tem no nome o seu último seq."""
+    d = os.path.dirname(path) or "."
+    base = os.path.basename(path) + ".journal"
+    segs = sorted(f for f in os.listdir(d) if f.startswith(base + ".") and f[len(base) + 1:].isdigit()
+                  and int(f[len(base) + 1:]) > since_seq)
+    for fname in segs + [base]:
+        fpath = os.path.join(d, fname)
+        if not os.path.exists(fpath): continue
+        with open(fpath, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break
+                if rec.get("seq", 0) <= since_seq: continue
+                if user_key is None or user_key in (rec.get("users") or {}) or rec.get("key") == user_key:
+                    yield rec
+
+# ====================================
+# Eventos de domínio (trilha de auditoria)
+# ====================================
+_events = threading.local()
+
+def note_event(event_type: str, /, **data: Any) -> None:
+    """Anexa um evento (answer, lesson_started, day_done, wizard_step, notified...)
+    à próxima gravação desta thread. Só o backend journal os persiste."""
+    lst = getattr(_events, "items", None)
+    if lst is None: lst = _events.items = []
+    lst.append({"type": event_type, **data})
+
+def reset_events() -> None:
+    _events.items = []
+
+def _take_events() -> List[Dict[str, Any]]:
+    lst = getattr(_events, "items", None) or []
+    _events.items = []
+    return lst
+
+# ==========================================
+# Cache LRU de usuários ativos (write-behind)
+# ==========================================
+class CachedStore:
+    """Cache em processo dos registros recentes na frente de qualquer backend.
+
+    - Leitura: dirty -> LRU -> backend. Os registros ficam serializados (uma
+      cópia por leitura, como no backend), então quem muta sem gravar não suja o cache.
+    - Gravação com `flush_ms` > 0 (write-behind): vai para `dirty` e uma thread
+      grava tudo num único put_users a cada flush_ms; despejo do LRU e close()
+      adiantam o flush. Garantia: crash do processo perde no máx. flush_ms de
+      gravações; com flush_ms = 0 é write-through (nada a perder, só cache de leitura).
+    - Entradas sem acesso há `ttl_s` saem do LRU (o flusher varre; a leitura
+      também confere, então vale igual no write-through). Só vale com um processo por
+      base (o cache não vê gravações de outro processo).
+    """
+
+    def __init__(self, inner: Any, size: int = 1024, ttl_s: float = 300.0, flush_ms: int = 200):
+        self.inner = inner
+        self.size = max(1, size)
+        self.ttl_s = ttl_s
+        self.flush_ms = flush_ms
+        self.hits = self.misses = self.flushes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._lru: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # key -> (último acesso, json)
+        self._dirty: Dict[str, str] = {}     # key -> json pendente
+        self._inflight: Dict[str, str] = {}  # lote sendo gravado agora
+        self._events: List[Dict[str, Any]] = []
+        self._wake = threading.Event()
+        self._closed = False
+        if flush_ms > 0:
+            threading.Thread(target=self._flusher, name="user-cache-flush", daemon=True).start()
+            atexit.register(self.close)
+
+    def __getattr__(self, name: str) -> Any:
+        # índices, meta, leases etc. vão direto ao backend
+        return getattr(self.inner, name)
+
+    # ---------- leitura ----------
+    def get_user(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            raw = self._dirty.get(key) or self._inflight.get(key)
+            if raw is None:
+                ent = self._lru.get(key)
+                if ent is not None and now - ent[0] > self.ttl_s:
+                    # vencida: sem o flusher (write-through) ninguém mais a remove
+                    del self._lru[key]
+                    ent = None
+                if ent is not None:
+                    raw = ent[1]
+                    self._lru[key] = (now, raw)
+                    self._lru.move_to_end(key)
+            if raw is not None:
+                self.hits += 1
+                return json.loads(raw)
+            self.misses += 1
+        user = self.inner.get_user(key)
+        if user is not None:
+            with self._lock:
+                if key not in self._lru and key not in self._dirty: self._remember(key, _dumps(user), now)
+        return user
+
+    def _remember(self, key: str, raw: str, now: float) -> None:
+        self._lru[key] = (now, raw)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.size:
+            old, _ = self._lru.popitem(last=False)
+            if old in self._dirty: self._wake.set()  # despejo de pendente: grava logo
+
+    # ---------- gravação ----------
+    def put_user(self, key: str, user: Dict[str, Any]) -> None:
+        self.put_users({key: user})
+
+    def put_users(self, items: Dict[str, Dict[str, Any]], events: Optional[List[Dict[str, Any]]] = None) -> None:
+        if not items: return
+        if self.flush_ms <= 0:
+            self.inner.put_users(items, events=events)
+        now = time.monotonic()
+        keys = list(items)
+        with self._lock:
+            for key, user in items.items():
+                raw = _dumps(user)
+                self._remember(key, raw, now)
+                if self.flush_ms > 0: self._dirty[key] = raw
+            if self.flush_ms > 0 and events:
+                # lote mistura usuários: cada evento leva a chave de origem
+                self._events.extend(ev if "user" in ev or len(keys) != 1 else {**ev, "user": keys[0]} for ev in events)
+
+    def delete_user(self, key: str, events: Optional[List[Dict[str, Any]]] = None) -> None:
+        self.flush()  # eventos pendentes deste usuário saem antes da remoção
+        with self._lock:
+            self._lru.pop(key, None)
+        self.inner.delete_user(key, events=events)
+
+    def flush(self) -> int:
+        """Grava as entradas pendentes; devolve quantas."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty: return 0
+                batch, self._dirty = self._dirty, {}
+                events, self._events = self._events, []
+                self._inflight = batch
+            try:
+                self.inner.put_users({k: json.loads(v) for k, v in batch.items()}, events=events or None)
+            except BaseException:
+                with self._lock:  # devolve o lote sem sobrescrever o que chegou depois
+                    for k, v in batch.items(): self._dirty.setdefault(k, v)
+                    self._events[:0] = events
+                raise
+            finally:
+                with self._lock: self._inflight = {}
+            self.flushes += 1
+            return len(batch)
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl_s
+        with self._lock:
+            while self._lru:
+                key, (seen, _) = next(iter(self._lru.items()))
+                if seen > cutoff: break
+                self._lru.popitem(last=False)
+
+    def _flusher(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_ms / 1000.0)
+            self._wake.clear()
+            try:
+                self.flush()
+                self._expire()
+            except Exception:
+                pass  # backend indisponível: o lote volta para dirty e tenta no próximo ciclo
+
+    def close(self) -> None:
+        self.flush()
+        self._closed = True
+        self._wake.set()
+        if hasattr(self.inner, "close"): self.inner.close()
+
+    # ---------- varreduras: precisam ver o que está pendente ----------
+    def user_keys(self) -> List[str]:
+        self.flush()
+        return self.inner.user_keys()
+
+    def iter_users(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        # lê do backend sem passar pelo LRU (export/varredura não despeja os
+        # usuários quentes); o que ficou pendente depois do flush prevalece
+        self.flush()
+        for key, user in self.inner.iter_users():
+            with self._lock:
+                raw = self._dirty.get(key) or self._inflight.get(key)
+            yield key, (json.loads(raw) if raw is not None else user)
+
+    def count_users(self) -> int:
+        self.flush()
+        return self.inner.count_users()
+
+    def load_all(self) -> Dict[str, Any]:
+        self.flush()
+        return self.inner.load_all()
+
+    def save_all(self, data: Dict[str, Any]) -> None:
+        self.flush()
+        with self._lock: self._lru.clear()
+        self.inner.save_all(data)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._lru), "dirty": len(self._dirty), "hits": self.hits,
+                    "misses": self.misses, "flushes": self.flushes}
+
+# ================
+# Seleção do backend
+# ================
+_store: Any = None
+_store_lock = threading.Lock()
+
+def _make_store(path: str, backend: str = "") -> Any:
+    backend = backend or ("sqlite" if path.lower().endswith(SQLITE_EXTS) else "json")
+    if backend == "sqlite": return SqliteStore(path)
+    if backend == "json": return JsonStore(path)
+    if backend == "journal": return JournalStore(path, JOURNAL_FSYNC_MS, JOURNAL_SNAPSHOT_EVERY)
+    if backend == "sharded": return ShardedJsonStore(os.path.splitext(path)[0] if path.endswith(".json") else path)
+    raise ValueError(f"STORAGE_BACKEND desconhecido: {backend}")
+
+def get_store() -> Any:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _make_store(DB_PATH, STORAGE_BACKEND)
+                if USER_CACHE_SIZE > 0:
+                    _store = CachedStore(_store, USER_CACHE_SIZE, USER_CACHE_TTL_S, USER_CACHE_FLUSH_MS)
+    return _store
 
 def load_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    if not os.path.exists(DB_PATH):
-        save_db({"users": {}})
-    with open(DB_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return get_store().load_all()
 
 def save_db(data):
-    with open(DB_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    get_store().save_all(data)
+
+# API por usuário: o webhook lê/grava só o registro tocado.
+def get_user(key: str) -> Optional[Dict[str, Any]]:
+    return get_store().get_user(key)
+
+def put_user(key: str, user: Dict[str, Any]) -> None:
+    get_store().put_users({key: user}, events=_take_events())
+
+def put_users(items: Dict[str, Dict[str, Any]]) -> None:
+    get_store().put_users(items, events=_take_events())
+
+def delete_user(key: str) -> None:
+    get_store().delete_user(key, events=_take_events())
+
+def user_keys() -> List[str]:
+    return get_store().user_keys()
+
+def iter_users() -> Iterator[Tuple[str, Dict[str, Any]]]:
+    return get_store().iter_users()
+
+def find_user_by_phone(digits: str) -> Optional[str]:
+    return get_store().find_user_by_phone(digits)
+
+def index_phones(key: str, phones: List[str]) -> None:
+    get_store().index_phones(key, phones)
+
+def index_schedule(key: str, deadlines: Dict[str, int]) -> None:
+    get_store().index_schedule(key, deadlines)
+
+def index_users(items: Dict[str, Dict[str, Any]]) -> None:
+    """Reindexa telefones e prazos de um lote de usuários (importação, carga)."""
+    get_store().index_users(items)
+
+def due_checkins(day_key: str, weekday: str, upto_min: int) -> List[str]:
+    """Usuários com prazo de check-in vencido hoje e ainda não tratados pelo cron."""
+    return get_store().due_checkins(day_key, weekday, upto_min)
+
+def mark_checked(day_key: str, keys: List[str]) -> None:
+    get_store().mark_checked(day_key, keys)
+
+def next_deadline(weekday: str, after_min: int) -> Optional[int]:
+    """Menor prazo do dia estritamente depois de `after_min` (minutos desde 00:00)."""
+    return get_store().next_deadline(weekday, after_min)
+
+def get_meta(name: str) -> Any:
+    return get_store().get_meta(name)
+
+def put_meta(name: str, value: Any) -> None:
+    get_store().put_meta(name, value)
+
+def db_size_bytes() -> int:
+    return get_store().size_bytes()
+
+def acquire_lease(name: str, owner: str, ttl_s: float) -> bool:
+    """Lease nomeado entre processos: True se `owner` o detém pelos próximos ttl_s."""
+    return get_store().acquire_lease(name, owner, ttl_s)
+
+# ================================
+# Migração JSON -> SQLite / fatiado
+# ================================
+def migrate_json_to_sqlite(json_path: str, sqlite_path: str) -> int:
+    """Copia todos os usuários do db.json para o SQLite (idempotente). Retorna o total."""
+    src = JsonStore(json_path).load_all()
+    dst = SqliteStore(sqlite_path)
+    users = src.get("users") or {}
+    conn = dst._conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for key, user in users.items():
+            full = {c: user.get(c) for c in USER_FIELDS}
+            full.update(user)
+            dst.put_user(key, full)
+            dst.index_phones(key, user_phones(full, key))
+            dst.index_schedule(key, schedule_deadlines(full))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return len(users)
+
+def migrate_json_to_sharded(json_path: str, root: str) -> int:
+    """Espalha o db.json em um arquivo por usuário sob `root` e refaz os índices."""
+    src = JsonStore(json_path).load_all()
+    ShardedJsonStore(root).save_all(src)
+    return len(src.get("users") or {})
+
+if __name__ == "__main__":
+    # python storage.py migrate data/db.json data/db.sqlite3
+    # python storage.py migrate data/db.json data/db/        (backend sharded)
+    # python storage.py audit data/db.json [chave]   (backend journal)
+    if len(sys.argv) == 4 and sys.argv[1] == "migrate":
+        dst = sys.argv[3]
+        n = (migrate_json_to_sqlite if dst.endswith(SQLITE_EXTS) else migrate_json_to_sharded)(sys.argv[2], dst)
+        print(f"{n} usuário(s) migrado(s) para {sys.argv[3]}")
+    elif len(sys.argv) in (3, 4) and sys.argv[1] == "audit":
+        for rec in iter_journal(sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else None):
+            for ev in rec.get("ev") or [{"type": rec["op"]}]:
+                print(_dumps({"seq": rec["seq"], "ts": rec["ts"], "users": list(rec.get("users") or [rec.get("key")]), **ev}))
+    else:
+        print("uso: python storage.py migrate <db.json> <db.sqlite3 | diretório>\n"
+              "     python storage.py audit <db.json> [chave]")
+        sys.exit(2)
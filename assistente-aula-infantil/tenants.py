@@ -0,0 +1,67 @@
+# Multi-tenant: um processo atende vários números do bot. Cada mensagem é
+# roteada pelo `To` para a configuração do seu número (nome da assistente,
+# remetente Twilio, flags, fuso e namespace no storage). Sem TENANTS_FILE há
+# um único tenant, montado das variáveis de ambiente de sempre.
+
+import json, os, re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+@dataclass(frozen=True)
+class Tenant:
+    number: str                 # número do bot (só dígitos); "" = padrão
+    namespace: str = ""         # prefixo das chaves no storage ("" = legado, sem prefixo)
+    name: str = "MARIA ANGELA"
+    twilio_from: str = ""
+    tz: str = "America/Bahia"
+    feature_portugues: bool = True
+    feature_leitura: bool = False
+
+    def key(self, digits: str) -> str:
+        """Chave do usuário neste tenant."""
+        return f"{self.namespace}:{digits}" if self.namespace and digits else digits
+
+def _digits(s: Optional[str]) -> str:
+    return re.sub(r"\D+", "", s or "")
+
+class TenantRegistry:
+    def __init__(self, default: Tenant, tenants: List[Tenant] = ()):
+        self.default = default
+        self.by_number: Dict[str, Tenant] = {}
+        self.by_namespace: Dict[str, Tenant] = {default.namespace: default}
+        for t in [default, *tenants]:
+            if t.number in self.by_number:
+                raise ValueError(f"número repetido entre tenants: {t.number!r}")
+            if t.number: self.by_number[t.number] = t
+            if t is not default and t.namespace in self.by_namespace:
+                raise ValueError(f"namespace repetido entre tenants: {t.namespace!r}")
+            self.by_namespace[t.namespace] = t
+
+    def for_number(self, to: Optional[str]) -> Tenant:
+        return self.by_number.get(_digits(to), self.default)
+
+    def for_key(self, key: str) -> Tenant:
+        ns = key.rpartition(":")[0]
+        return self.by_namespace.get(ns, self.default)
+
+    def all(self) -> List[Tenant]:
+        return list(self.by_namespace.values())
+
+def load_tenants(path: str, default: Tenant) -> TenantRegistry:
+    """TENANTS_FILE: lista JSON de objetos com os campos de Tenant (number e
+    namespace obrigatórios); campos omitidos herdam do tenant padrão."""
+    if not path or not os.path.exists(path): return TenantRegistry(default)
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    known = set(Tenant.__dataclass_fields__)
+    tenants = []
+    for item in raw:
+        if not item.get("namespace"):
+            raise ValueError(f"tenant {item.get('number')!r} sem namespace")
+        if not _digits(item.get("number")):  # sem número cairia no BOT_NUMBER do padrão
+            raise ValueError(f"tenant {item['namespace']!r} sem number")
+        base = {k: getattr(default, k) for k in known}
+        base.update({k: v for k, v in item.items() if k in known})
+        base["number"] = _digits(item["number"])
+        tenants.append(Tenant(**base))
+    return TenantRegistry(default, tenants)
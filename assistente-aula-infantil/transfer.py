@@ -0,0 +1,60 @@
+# Exportação/importação em NDJSON: um registro {"key", "user"} por linha,
+# sempre por geradores (um usuário de cada vez na memória), para extrair a base
+# inteira ou um recorte (série, última atividade, tenant) sem carregar o db.json
+# e sem segurar o lock do webhook durante a varredura.
+
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+def last_active(user: Dict[str, Any]) -> Optional[str]:
+    """Último dia ("YYYY-MM-DD") com registro no daily_state; se já foi todo
+    compactado, o último dia feito no resumo mensal (ou o dia 1 do mês)."""
+    days = user.get("daily_state") or {}
+    if days: return max(days)
+    summary = user.get("daily_summary") or {}
+    if not summary: return None
+    month = max(summary)
+    mask = int(summary[month].get("mask", 0))
+    return f"{month}-{max(1, mask.bit_length()):02d}"
+
+def matches(key: str, user: Dict[str, Any], grade: str = "", since: str = "", until: str = "",
+            namespace: Optional[str] = None) -> bool:
+    """Filtros do export; vazio = não filtra. since/until valem para last_active (inclusivos)."""
+    if namespace is not None and key.rpartition(":")[0] != namespace: return False
+    if grade and (user.get("profile") or {}).get("grade") != grade: return False
+    if since or until:
+        last = last_active(user)
+        if last is None: return False
+        if since and last < since: return False
+        if until and last > until: return False
+    return True
+
+def export_lines(users: Iterable[Tuple[str, Dict[str, Any]]], **filters: Any) -> Iterator[str]:
+    for key, user in users:
+        if matches(key, user, **filters):
+            yield json.dumps({"key": key, "user": user}, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def read_records(lines: Iterable[Any], errors: List[Dict[str, Any]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Registros válidos das linhas (bytes ou str); as inválidas vão para `errors`
+    com o número da linha e a importação segue."""
+    for n, line in enumerate(lines, 1):
+        if isinstance(line, bytes): line = line.decode("utf-8")
+        if not line.strip(): continue
+        try:
+            rec = json.loads(line)
+            key, user = rec["key"], rec["user"]
+            if not isinstance(key, str) or not key or not isinstance(user, dict):
+                raise ValueError("key deve ser texto e user um objeto")
+        except (ValueError, KeyError, TypeError) as e:
+            errors.append({"line": n, "error": str(e) or type(e).__name__})
+            continue
+        yield key, user
+
+def batches(records: Iterable[Tuple[str, Dict[str, Any]]], size: int) -> Iterator[Dict[str, Dict[str, Any]]]:
+    batch: Dict[str, Dict[str, Any]] = {}
+    for key, user in records:
+        batch[key] = user
+        if len(batch) >= size:
+            yield batch
+            batch = {}
+    if batch: yield batch
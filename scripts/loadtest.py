@@ -0,0 +1,147 @@
+# scripts/loadtest.py
+# Benchmark offline do /bot: N famílias sintéticas fazem a conversa completa
+# (wizard → "começar aula" → respostas a/b/c/d → "status"), com o Twilio em
+# memória (TWILIO_FAKE). Mede p50/p95/p99 e vazão para cada tamanho de base,
+# no test client do Flask e/ou num waitress local, para regressões de storage
+# aparecerem como número.
+#
+#   python scripts/loadtest.py --families 20 --sizes 0,1000,10000
+#   python scripts/loadtest.py --mode waitress --workers 8 --db /tmp/lt.sqlite3
+#   python scripts/loadtest.py --json resultados.json
+#   USER_CACHE_SIZE=1000 python scripts/loadtest.py   # com o cache de usuários (write-behind)
+import argparse, json, os, sys, tempfile, threading, time, urllib.parse, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(BASE_DIR, "assistente-aula-infantil")
+
+WIZARD = ["iniciar", "Ana", "8", "3", "ok", "pular", "ok"] + ["ok"] * 6 + ["sim"]
+
+def percentile(sorted_ms: List[float], p: float) -> float:
+    if not sorted_ms: return 0.0
+    i = min(len(sorted_ms) - 1, max(0, int(round(p / 100.0 * len(sorted_ms) + 0.5)) - 1))
+    return sorted_ms[i]
+
+def grow_db(server: Any, storage: Any, start: int, target: int, history_days: int) -> None:
+    """Completa a base com usuários de enchimento (perfil pronto + histórico),
+    já nos índices de telefone e de prazos, para o tamanho deles pesar também."""
+    today = date.fromisoformat(server._today_str())
+    batch: Dict[str, Dict[str, Any]] = {}
+    for i in range(start, target):
+        key = f"55600{i:08d}"
+        user = server._new_user(key)
+        user["profile"].update({"child_name": f"Filler {i}", "child_age": 8, "grade": "3º ano",
+                                "guardians": [key, f"55601{i:08d}"]})
+        user["schedule"] = {"mon": "18:00", "wed": "18:00"}
+        user["daily_state"] = {(today - timedelta(days=d)).isoformat(): {"done": d % 3 != 0}
+                               for d in range(1, history_days + 1)}
+        batch[key] = user
+        if len(batch) >= 500:
+            storage.put_users(batch)
+            storage.index_users(batch)
+            batch = {}
+    if batch:
+        storage.put_users(batch)
+        storage.index_users(batch)
+
+def make_poster(mode: str, app: Any) -> Callable[[str, str], str]:
+    if mode == "client":
+        def post(frm: str, body: str) -> str:
+            r = app.test_client().post("/bot", data={"From": f"whatsapp:+{frm}", "Body": body})
+            assert r.status_code == 200, r.status_code
+            return r.get_data(as_text=True)
+        return post
+
+    from waitress.server import create_server
+    srv = create_server(app, host="127.0.0.1", port=0, threads=8)
+    threading.Thread(target=srv.run, name="loadtest-waitress", daemon=True).start()
+    url = f"http://127.0.0.1:{srv.effective_port}/bot"
+
+    def post(frm: str, body: str) -> str:
+        data = urllib.parse.urlencode({"From": f"whatsapp:+{frm}", "Body": body}).encode()
+        with urllib.request.urlopen(url, data=data, timeout=30) as r:
+            assert r.status == 200, r.status
+            return r.read().decode("utf-8")
+    return post
+
+def conversation(post: Callable[[str, str], str], frm: str, lat: List[float], answers: List[float]) -> None:
+    def timed(body: str, into: Optional[List[float]] = None) -> str:
+        t0 = time.perf_counter()
+        out = post(frm, body)
+        ms = (time.perf_counter() - t0) * 1000.0
+        lat.append(ms)
+        if into is not None: into.append(ms)
+        return out
+    for m in WIZARD: timed(m)
+    out = timed("começar aula")
+    for i in range(40):  # 10 perguntas, até 3 tentativas cada
+        if "Aula conclu" in out: break
+        out = timed("abcd"[i % 4], answers)
+    timed("status")
+
+def run_round(post: Callable[[str, str], str], families: int, workers: int, tag: str) -> Dict[str, Any]:
+    lats: List[List[float]] = [[] for _ in range(families)]
+    answers: List[List[float]] = [[] for _ in range(families)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        futs = [ex.submit(conversation, post, f"55719{tag}{i:05d}", lats[i], answers[i]) for i in range(families)]
+        for f in futs: f.result()
+    elapsed = time.perf_counter() - t0
+    ms = sorted(x for l in lats for x in l)
+    ans = sorted(x for l in answers for x in l)
+    return {"requests": len(ms), "elapsed_s": round(elapsed, 3),
+            "rps": round(len(ms) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(ms, 50), 2), "p95_ms": round(percentile(ms, 95), 2),
+            "p99_ms": round(percentile(ms, 99), 2), "max_ms": round(ms[-1], 2) if ms else 0.0,
+            # só as respostas a/b/c/d durante a aula (o caminho quente)
+            "answer_p50_ms": round(percentile(ans, 50), 2), "answer_p95_ms": round(percentile(ans, 95), 2)}
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--families", type=int, default=20, help="conversas completas por rodada")
+    ap.add_argument("--workers", type=int, default=4, help="famílias simultâneas")
+    ap.add_argument("--sizes", default="0,1000,5000", help="tamanhos de base (usuários), crescentes")
+    ap.add_argument("--history-days", type=int, default=30, help="dias de daily_state por usuário de enchimento")
+    ap.add_argument("--mode", choices=("client", "waitress", "both"), default="both")
+    ap.add_argument("--db", default="", help="DB_PATH (padrão: db.json temporário)")
+    ap.add_argument("--json", default="", help="grava os resultados neste arquivo")
+    args = ap.parse_args()
+
+    os.environ["DB_PATH"] = args.db or os.path.join(tempfile.mkdtemp(), "db.json")
+    os.environ["TWILIO_FAKE"] = "True"
+    os.environ["SCHEDULER_ENABLED"] = "False"
+    sys.path.insert(0, APP_DIR)
+    import server, storage
+
+    modes = ["client", "waitress"] if args.mode == "both" else [args.mode]
+    posters = {m: make_poster(m, server.app) for m in modes}
+    sizes = sorted(int(s) for s in args.sizes.split(",") if s.strip())
+
+    results: List[Dict[str, Any]] = []
+    print(f"DB={os.environ['DB_PATH']}  famílias/rodada={args.families}  workers={args.workers}")
+    print(f"{'modo':<9}{'usuários':>10}{'MB':>8}{'req':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'resp p50':>10}{'resp p95':>10}")
+    have = 0
+    for rnd, size in enumerate(sizes):
+        if size > have:
+            grow_db(server, storage, have, size, args.history_days)
+            have = size
+        for m in modes:
+            # números novos por rodada: cada família passa pelo wizard do zero
+            r = run_round(posters[m], args.families, args.workers, f"{rnd:02d}{modes.index(m)}")
+            r.update({"mode": m, "db_users": len(storage.user_keys()),
+                      "db_mb": round(storage.db_size_bytes() / 1e6, 2)})
+            results.append(r)
+            print(f"{m:<9}{r['db_users']:>10}{r['db_mb']:>8}{r['requests']:>7}{r['rps']:>9}"
+                  f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['answer_p50_ms']:>10}{r['answer_p95_ms']:>10}")
+
+    server._get_outbox().drain(5.0)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# scripts/stress_bot.py
+# Dispara centenas de POSTs simultâneos no /bot (como o Twilio faria) e confere
+# que nenhum progresso de aula nem flag do daily_state se perdeu.
+#
+#   python scripts/stress_bot.py --families 20 --workers 32
+#   python scripts/stress_bot.py --db /tmp/stress.sqlite3
+#   python scripts/stress_bot.py --no-locks     # demonstra as perdas sem os locks
+import argparse, contextlib, os, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(BASE_DIR, "assistente-aula-infantil")
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--families", type=int, default=20)
+    ap.add_argument("--status-per-family", type=int, default=10)
+    ap.add_argument("--workers", type=int, default=32, help="mínimo: 2 por família")
+    ap.add_argument("--db", default="", help="DB_PATH (padrão: db.json temporário)")
+    ap.add_argument("--no-locks", action="store_true")
+    args = ap.parse_args()
+
+    os.environ["DB_PATH"] = args.db or os.path.join(tempfile.mkdtemp(), "db.json")
+    for k in ("TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN"):
+        os.environ.pop(k, None)
+    sys.path.insert(0, APP_DIR)
+    import server, storage
+
+    if args.no_locks:
+        server.user_lock = lambda *keys: contextlib.nullcontext()
+
+    fams = []
+    for i in range(args.families):
+        key = f"55719{i:08d}"
+        child, g2 = f"55718{i:08d}", f"55717{i:08d}"
+        user = server._new_user(key)
+        user["profile"].update({"child_name": f"Crianca {i}", "child_age": 8, "grade": "3º ano",
+                                "child_phone": child, "guardians": [key, g2]})
+        storage.put_user(key, user)
+        storage.index_phones(key, storage.user_phones(user, key))
+        fams.append((key, child, g2))
+
+    def post(frm: str, body: str) -> str:
+        r = server.app.test_client().post("/bot", data={"From": f"whatsapp:+{frm}", "Body": body})
+        assert r.status_code == 200, r.status_code
+        return r.get_data(as_text=True)
+
+    def child_flow(child: str, done: threading.Event) -> bool:
+        try:
+            out = post(child, "começar aula")
+            for i in range(400):
+                if "Aula concluída" in out: return True
+                out = post(child, "abcd"[i % 4])
+            return False
+        finally:
+            done.set()
+
+    def guardian_flow(g2: str, n: int, done: threading.Event) -> None:
+        # consulta enquanto a criança responde, e mais n vezes depois
+        while not done.is_set(): post(g2, "status")
+        for _ in range(n): post(g2, "status")
+
+    sys.setswitchinterval(1e-5)  # mais trocas de thread = mais intercalações
+    events = [threading.Event() for _ in fams]
+    t0 = time.perf_counter()
+    workers = max(args.workers, 2 * len(fams))
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futs = [ex.submit(child_flow, c, ev) for (_, c, _), ev in zip(fams, events)]
+        futs += [ex.submit(guardian_flow, g, args.status_per_family, ev) for (_, _, g), ev in zip(fams, events)]
+        futs += [ex.submit(post, k, "fim") for k, _, _ in fams]
+        finished = [f.result() for f in futs[:len(fams)]]
+        for f in futs[len(fams):]: f.result()
+    elapsed = time.perf_counter() - t0
+
+    today = server._today_str()
+    lost = 0
+    for (key, _, _), ok in zip(fams, finished):
+        user = storage.get_user(key) or {}
+        st = (user.get("daily_state") or {}).get(today) or {}
+        problems = []
+        if not ok: problems.append("aula não terminou")
+        if user.get("lesson"): problems.append("aula voltou a ficar em andamento")
+        if not st.get("done"): problems.append("done perdido")
+        if not st.get("done_notified"): problems.append("done_notified perdido")
+        if problems:
+            lost += 1
+            print(f"{key}: {', '.join(problems)}")
+    print(f"{len(fams)} famílias, {workers} threads, {elapsed:.2f}s, DB={os.environ['DB_PATH']}")
+    print("OK: nenhuma atualização perdida" if not lost else f"FALHA: {lost} família(s) com perdas")
+    return 1 if lost else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
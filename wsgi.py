@@ -17,7 +17,7 @@ if APP_DIR not in sys.path:
     sys.path.insert(0, APP_DIR)
 
 # PRÉ-CARREGA módulos que o server.py importa por nome simples
-for fname in ['storage.py', 'progress.py', 'notifications.py', 'activities.py', 'leitura.py']:
+for fname in ['metrics.py', 'idempotency.py', 'tenants.py', 'storage.py', 'outbox.py', 'progress.py', 'notifications.py', 'retention.py', 'question_bank.py', 'skill.py', 'transfer.py', 'rollups.py', 'digest.py', 'activities.py', 'leitura.py']:
     fpath = os.path.join(APP_DIR, fname)
     if os.path.exists(fpath):
         _load_module(os.path.splitext(fname)[0], fpath)